@@ -1,8 +1,18 @@
 from django.contrib import admin
-from .models import Customer, Seller, Product, Order, PlatformApiCall
+from .models import (
+    Customer, Seller, Product, Order, PlatformApiCall, ProductImportRun, ProductImportChunk,
+    CustomerOrderSummary, SellerOrderSummary, TopOrder, DailySales, RollupWatermark,
+)
 
 admin.site.register(Customer)
 admin.site.register(Seller)
 admin.site.register(Product)
 admin.site.register(Order)
-admin.site.register(PlatformApiCall)
\ No newline at end of file
+admin.site.register(PlatformApiCall)
+admin.site.register(ProductImportRun)
+admin.site.register(ProductImportChunk)
+admin.site.register(CustomerOrderSummary)
+admin.site.register(SellerOrderSummary)
+admin.site.register(TopOrder)
+admin.site.register(DailySales)
+admin.site.register(RollupWatermark)
\ No newline at end of file
@@ -0,0 +1,120 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import QuerySet
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import audit, replicas
+from .serializers import OrderReadSerializer, ProductSerializer
+from .views import OrderViewSet, ProductViewSet
+
+
+class AsyncReadView:
+    """
+    List and retrieve for a DRF viewset, read with the async ORM. The
+    viewset's own authentication, permissions, throttles, scoping and filters
+    run in one sync_to_async step, as they may query; the rows are then read
+    and serialized on the event loop, and the call is queued for the audit
+    log without waiting on it. Responses are neither cached nor given ETags.
+    """
+    viewset_class = None
+    serializer_class = None
+    renderer = JSONRenderer()
+
+    def __init__(self, action):
+        self.action = action
+
+    @classmethod
+    def as_view(cls, action):
+        async def view(request, **kwargs):
+            return await cls(action).dispatch(request, kwargs)
+        return view
+
+    async def dispatch(self, request, kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        view = self.viewset_class(
+            action_map={'get': self.action, 'head': self.action}, args=(), kwargs=kwargs, format_kwarg=None, headers={},
+        )
+        drf_request = view.initialize_request(request, **kwargs)
+        view.request = drf_request
+        try:
+            queryset = await sync_to_async(self.prepare)(view, drf_request)
+            if self.action == 'list':
+                data = await self.list(view, drf_request, queryset)
+            else:
+                data = await self.retrieve(view, drf_request, queryset, kwargs)
+            response = Response(data)
+        except exceptions.APIException as exc:
+            response = self.error_response(view, drf_request, exc)
+        return await self.finalize(view, drf_request, response)
+
+    def prepare(self, view, request):
+        view.initial(request)
+        return view.filter_queryset(view.get_queryset())
+
+    async def list(self, view, request, queryset):
+        paginator = view.paginator
+        if paginator is not None:
+            page = await paginator.apaginate_queryset(queryset, request, view)
+            if page is not None:
+                return paginator.get_paginated_response(await self.serialize(view, page, many=True)).data
+        return await self.serialize(view, queryset, many=True)
+
+    async def retrieve(self, view, request, queryset, kwargs):
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        try:
+            instance = await queryset.aget(**{view.lookup_field: kwargs[lookup_url_kwarg]})
+        except ObjectDoesNotExist:
+            raise exceptions.NotFound()
+        view.check_object_permissions(request, instance)
+        return await self.serialize(view, instance)
+
+    async def serialize(self, view, instance, many=False):
+        # Serializers with an async `adata` run their own queries; for the
+        # rest the rows are read first, so `data` only formats them
+        has_adata = hasattr(self.serializer_class, 'adata')
+        if many and isinstance(instance, QuerySet) and not has_adata:
+            instance = [row async for row in instance]
+        serializer = self.serializer_class(instance, many=many, context=view.get_serializer_context())
+        return await serializer.adata() if has_adata else serializer.data
+
+    def error_response(self, view, request, exc):
+        # What APIView.handle_exception does, minus touching the database
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            auth_header = view.get_authenticate_header(request)
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = 403
+        headers = {'WWW-Authenticate': exc.auth_header} if getattr(exc, 'auth_header', None) else None
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return Response(data, status=exc.status_code, headers=headers)
+
+    async def finalize(self, view, request, response):
+        if getattr(view, 'replica_routing', None) is not None:
+            replicas.end(request.user)
+        if request.user.is_authenticated:
+            await audit.alog_api_call(
+                request, response, audit.get_policy(view.api_call_log_policy),
+                action=self.action, started=getattr(view, 'api_call_started', None),
+            )
+        http_response = HttpResponse(
+            self.renderer.render(response.data), status=response.status_code, content_type=self.renderer.media_type,
+        )
+        for name, value in response.items():
+            if name.lower() != 'content-type':
+                http_response[name] = value
+        return http_response
+
+
+class AsyncOrderView(AsyncReadView):
+    viewset_class = OrderViewSet
+    serializer_class = OrderReadSerializer
+
+
+class AsyncProductView(AsyncReadView):
+    viewset_class = ProductViewSet
+    serializer_class = ProductSerializer
@@ -0,0 +1,346 @@
+import atexit
+import base64
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import PlatformApiCall
+
+logger = logging.getLogger(__name__)
+
+MODE_SYNC = 'sync'
+MODE_BUFFERED = 'buffered'
+MODE_CELERY = 'celery'
+
+
+ENCODING_ZLIB = 'zlib'
+
+TRUNCATION_MARKER = '...[truncated {omitted} chars]'
+
+
+def get_policy(overrides=None):
+    """
+    The logging policy for a view: the API_CALL_LOG_* settings, updated with
+    the view's `api_call_log_policy`.
+
+    `sample_rates` maps an action ('list'), a method ('GET') or both
+    ('GET list') to the fraction of those calls to log, falling back to
+    `sample_rate`; failed calls are always logged when `always_log_errors`.
+    Stored bodies are cut at `max_payload` characters (0 = no limit) and
+    zlib-compressed when `compress`; `metadata_only` keeps just the URL,
+    user, method, status and duration.
+    """
+    policy = {
+        'sample_rate': getattr(settings, 'API_CALL_LOG_SAMPLE_RATE', 1.0),
+        'sample_rates': {},
+        'always_log_errors': True,
+        'max_payload': getattr(settings, 'API_CALL_LOG_MAX_PAYLOAD', 0),
+        'compress': getattr(settings, 'API_CALL_LOG_COMPRESS', False),
+        'metadata_only': getattr(settings, 'API_CALL_LOG_METADATA_ONLY', False),
+    }
+    if overrides:
+        policy.update(overrides)
+    return policy
+
+
+def should_log(policy, method, action, status_code):
+    if policy['always_log_errors'] and status_code >= 400:
+        return True
+    rates = policy['sample_rates']
+    for key in (f'{method} {action}', action, method):
+        if key in rates:
+            rate = rates[key]
+            break
+    else:
+        rate = policy['sample_rate']
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def build_record(request, response, policy=None, started=None):
+    # Bodies are stringified and cut to `max_payload` here, so a queued
+    # record never holds on to the request's or response's data; compressing
+    # them is left to the flusher so the request thread does not pay for it.
+    policy = policy or get_policy()
+    record = {
+        'user_id': request.user.pk,
+        'requested_url': request.build_absolute_uri(),
+        'method': request.method,
+        'status_code': response.status_code,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3) if started is not None else None,
+        'timestamp': timezone.now(),
+    }
+    if not policy['metadata_only']:
+        record.update({
+            'requested_data': truncate_payload(
+                request.data if request.method in ['POST', 'PUT', 'PATCH'] else {}, policy['max_payload'],
+            ),
+            # Streamed exports have no data to keep
+            'response_data': truncate_payload(getattr(response, 'data', ''), policy['max_payload']),
+            'compress': policy['compress'],
+        })
+    return record
+
+
+def record_size(record):
+    # Rough bytes held by a queued record: its bodies plus a fixed allowance
+    # for the other fields
+    return 256 + sum(
+        len(record[field]) for field in ('requested_data', 'response_data') if isinstance(record.get(field), str)
+    )
+
+
+def truncate_payload(value, max_payload=0):
+    text = str(value)
+    if max_payload and len(text) > max_payload:
+        text = text[:max_payload] + TRUNCATION_MARKER.format(omitted=len(text) - max_payload)
+    return text
+
+
+def encode_payload(value, max_payload=0, compress=False):
+    text = truncate_payload(value, max_payload)
+    if compress:
+        text = base64.b64encode(zlib.compress(text.encode())).decode('ascii')
+    return text
+
+
+def decode_payload(value, encoding):
+    if encoding == ENCODING_ZLIB and value:
+        return zlib.decompress(base64.b64decode(value)).decode()
+    return value
+
+
+def to_model(record):
+    max_payload, compress = record.get('max_payload', 0), record.get('compress', False)
+    has_payload = 'response_data' in record
+    return PlatformApiCall(
+        user_id=record['user_id'],
+        requested_url=record['requested_url'],
+        method=record.get('method', ''),
+        status_code=record.get('status_code'),
+        duration_ms=record.get('duration_ms'),
+        requested_data=encode_payload(record['requested_data'], max_payload, compress) if has_payload else '',
+        response_data=encode_payload(record['response_data'], max_payload, compress) if has_payload else '',
+        payload_encoding=ENCODING_ZLIB if compress and has_payload else '',
+        timestamp=record['timestamp'],
+    )
+
+
+PAYLOAD_FIELDS = [
+    'user_id', 'requested_url', 'method', 'status_code', 'duration_ms',
+    'requested_data', 'response_data', 'payload_encoding',
+]
+
+
+def to_payload(record):
+    # JSON-safe form of a record for handing off to Celery.
+    model = to_model(record)
+    payload = {field: getattr(model, field) for field in PAYLOAD_FIELDS}
+    payload['timestamp'] = model.timestamp.isoformat()
+    return payload
+
+
+def write_records(records, batch_size=None):
+    PlatformApiCall.objects.bulk_create([to_model(record) for record in records], batch_size=batch_size)
+
+
+def send_to_celery(records, batch_size=None):
+    from .tasks import write_api_calls
+    write_api_calls.delay([to_payload(record) for record in records])
+
+
+class ApiCallBuffer:
+    """
+    Bounded in-memory queue of API call records, drained in batches by a
+    background thread once it holds `batch_size` records or `flush_interval`
+    seconds have passed. It holds at most `max_size` records and, unless
+    `max_bytes` is 0, about that many bytes of them (see record_size).
+    """
+
+    def __init__(self, sink=write_records, batch_size=200, flush_interval=2.0, max_size=10000, put_timeout=0.05,
+                 max_bytes=0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.put_timeout = put_timeout
+        self._queue = deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.blocked = 0
+
+    def put(self, record, block=True):
+        # With `block=False` a full queue drops the record straight away, for
+        # callers that must never wait (async views on the event loop)
+        size = record_size(record)
+
+        def full():
+            return len(self._queue) >= self.max_size or (
+                self.max_bytes and self._queue and self._bytes + size > self.max_bytes
+            )
+
+        with self._cond:
+            if full():
+                # Backpressure: wake the flusher and give it a moment to make
+                # room before giving up on the record.
+                self.blocked += 1
+                self._cond.notify_all()
+                if block and self._thread is not None:
+                    self._cond.wait_for(lambda: not full(), timeout=self.put_timeout)
+                if full():
+                    self.dropped += 1
+                    return False
+            self._queue.append((record, size))
+            self._bytes += size
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            written = 0
+            while True:
+                with self._cond:
+                    if not self._queue:
+                        break
+                    batch = []
+                    for _ in range(min(self.batch_size, len(self._queue))):
+                        record, size = self._queue.popleft()
+                        self._bytes -= size
+                        batch.append(record)
+                    self._cond.notify_all()
+                try:
+                    self.sink(batch, batch_size=self.batch_size)
+                except Exception:
+                    logger.exception('Failed to write %d API call records', len(batch))
+                    with self._cond:
+                        self.failed += len(batch)
+                else:
+                    written += len(batch)
+                    with self._cond:
+                        self.flushed += len(batch)
+            return written
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='api-call-log-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            thread = self._thread
+            self._stopped = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._cond:
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or len(self._queue) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                stopped = self._stopped
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+            if stopped:
+                return
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._queue),
+                'pending_bytes': self._bytes,
+                'enqueued': self.enqueued,
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'blocked': self.blocked,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_mode():
+    return getattr(settings, 'API_CALL_LOG_MODE', MODE_SYNC)
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = ApiCallBuffer(
+                    sink=send_to_celery if get_mode() == MODE_CELERY else write_records,
+                    batch_size=getattr(settings, 'API_CALL_LOG_BATCH_SIZE', 200),
+                    flush_interval=getattr(settings, 'API_CALL_LOG_FLUSH_INTERVAL', 2.0),
+                    max_size=getattr(settings, 'API_CALL_LOG_MAX_QUEUE', 10000),
+                    max_bytes=getattr(settings, 'API_CALL_LOG_MAX_QUEUE_BYTES', 0),
+                )
+                buffer.start()
+                _buffer = buffer
+    return _buffer
+
+
+def log_api_call(request, response, policy=None, action=None, started=None):
+    policy = policy or get_policy()
+    if not should_log(policy, request.method, action, response.status_code):
+        return
+    record = build_record(request, response, policy, started)
+    if get_mode() == MODE_SYNC:
+        write_records([record])
+    else:
+        get_buffer().put(record)
+
+
+async def alog_api_call(request, response, policy=None, action=None, started=None):
+    # log_api_call for async views: through the buffer without waiting, so
+    # the event loop never writes to the database; sync mode still writes
+    # inline, from a thread
+    policy = policy or get_policy()
+    if not should_log(policy, request.method, action, response.status_code):
+        return
+    record = build_record(request, response, policy, started)
+    if get_mode() == MODE_SYNC:
+        await sync_to_async(write_records)([record])
+    else:
+        get_buffer().put(record, block=False)
+
+
+def shutdown():
+    if _buffer is not None:
+        _buffer.stop()
+
+
+def stats():
+    return _buffer.stats() if _buffer is not None else {}
+
+
+atexit.register(shutdown)
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenLRU:
+    """
+    Bounded, thread-safe token key -> Token map; the least recently used
+    entry goes first once `max_size` is reached and entries expire after
+    `ttl` seconds.
+    """
+
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        with self._lock:
+            self._entries[key] = (token, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_tokens = TokenLRU(
+    max_size=getattr(settings, 'TOKEN_AUTH_LRU_SIZE', 10000),
+    ttl=getattr(settings, 'TOKEN_AUTH_LRU_TTL', 30),
+)
+
+
+def cache_key(key):
+    # Raw tokens never end up in cache keys
+    return f'authtoken:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def invalidate(keys):
+    keys = list(keys)
+    for key in keys:
+        local_tokens.delete(key)
+    cache.delete_many([cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that remembers tokens, with their users, in a
+    process-local LRU in front of the Django cache, so a warm request runs
+    no auth queries. Deleting a token or saving its user (which covers
+    deactivation) drops it from the Django cache and this process's LRU;
+    other processes stop trusting their copy within TOKEN_AUTH_LRU_TTL.
+    """
+
+    def authenticate_credentials(self, key):
+        token = local_tokens.get(key)
+        if token is None:
+            token = cache.get(cache_key(key))
+            if token is None:
+                user, token = super().authenticate_credentials(key)
+                cache.set(cache_key(key), token, getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 300))
+            local_tokens.set(key, token)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user, token
@@ -0,0 +1,408 @@
+import asyncio
+import copy
+import io
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import pooling, summaries
+from .models import Customer, Seller, Product, Order
+
+# Most queries each endpoint may run for one request, whatever the data size;
+# counted with a cold cache and without audit logging. Creates include two
+# savepoints when run inside a transaction, as in the tests.
+QUERY_BUDGETS = {
+    'order-list': 3,
+    'order-list-ordering': 3,
+    'order-search': 4,
+    'order-retrieve': 3,
+    'order-create': 12,
+    'product-list': 2,
+    'product-search': 3,
+    'product-retrieve': 2,
+    'product-create': 3,
+    'api-call-list': 1,
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Fixture:
+    """
+    Seeds `customers`, `sellers`, `products` and `orders` with
+    `products_per_order` products each using bulk inserts, so the same
+    scenarios can be run at any scale.
+    """
+
+    def __init__(self, customers=10, sellers=5, products=100, orders=1000, products_per_order=3, prefix='bench'):
+        self.scale = {
+            'customers': customers, 'sellers': sellers, 'products': products,
+            'orders': orders, 'products_per_order': products_per_order,
+        }
+        self.prefix = prefix
+
+    def seed(self):
+        scale, prefix = self.scale, self.prefix
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}-customer-{n}') for n in range(scale['customers'])]
+            + [User(username=f'{prefix}-seller-{n}') for n in range(scale['sellers'])]
+        )
+        self.customers = Customer.objects.bulk_create([
+            Customer(user=user, name=f'Customer {n}', mobile=str(n)) for n, user in enumerate(users[:scale['customers']])
+        ])
+        self.sellers = Seller.objects.bulk_create([
+            Seller(user=user, name=f'Seller {n}', mobile=str(n)) for n, user in enumerate(users[scale['customers']:])
+        ])
+        self.products = Product.objects.bulk_create([
+            Product(name=f'{prefix} product {n:06d}', amount=n % 500 + 1) for n in range(scale['products'])
+        ])
+        self.orders = Order.objects.bulk_create([
+            Order(
+                customer=self.customers[n % len(self.customers)],
+                seller=self.sellers[n % len(self.sellers)],
+                amount=n % 1000,
+            )
+            for n in range(scale['orders'])
+        ], batch_size=1000)
+        through = Order.products.through
+        through.objects.bulk_create([
+            through(order_id=order.id, product_id=self.products[(i + j) % len(self.products)].id)
+            for i, order in enumerate(self.orders) for j in range(scale['products_per_order'])
+        ], batch_size=5000)
+        summaries.rebuild()
+        self.admin = User.objects.create_user(username=f'{prefix}-admin', is_staff=True)
+        return self
+
+    def scenarios(self):
+        """
+        (name, method, url, payload factory) for every measured request; the
+        factory gets the iteration number so creates stay unique.
+        """
+        order, product = self.orders[len(self.orders) // 2], self.products[len(self.products) // 2]
+        order_payload = lambda n: {
+            'customer_id': self.customers[0].id,
+            'seller_id': self.sellers[0].id,
+            'product_ids': [p.id for p in self.products[:self.scale['products_per_order']]],
+        }
+        return [
+            ('order-list', 'get', reverse('order-list'), lambda n: {'page_size': 50}),
+            ('order-list-ordering', 'get', reverse('order-list'), lambda n: {'page_size': 50, 'ordering': '-amount'}),
+            ('order-search', 'get', reverse('order-list'), lambda n: {'page_size': 50, 'search': 'product 00001'}),
+            ('order-retrieve', 'get', reverse('order-detail', kwargs={'pk': order.id}), lambda n: None),
+            ('order-create', 'post', reverse('order-list'), order_payload),
+            ('product-list', 'get', reverse('product-list'), lambda n: {'ordering': 'amount'}),
+            ('product-search', 'get', reverse('product-list'), lambda n: {'search': 'product 00001'}),
+            ('product-retrieve', 'get', reverse('product-detail', kwargs={'pk': product.id}), lambda n: None),
+            ('product-create', 'post', reverse('product-list'), lambda n: {'name': f'{self.prefix} new {n}', 'amount': '1.00'}),
+            ('api-call-list', 'get', reverse('platformapicall-list'), lambda n: {'page_size': 50}),
+        ]
+
+    def read_scenarios(self):
+        # (name, sync url, async url, query params) for the endpoints served both ways
+        order, product = self.orders[len(self.orders) // 2], self.products[len(self.products) // 2]
+        return [
+            ('order-list', reverse('order-list'), reverse('async-order-list'), {'page_size': 50}),
+            ('order-retrieve', reverse('order-detail', kwargs={'pk': order.id}), reverse('async-order-detail', kwargs={'pk': order.id}), {}),
+            ('product-list', reverse('product-list'), reverse('async-product-list'), {'ordering': 'amount'}),
+            ('product-retrieve', reverse('product-detail', kwargs={'pk': product.id}), reverse('async-product-detail', kwargs={'pk': product.id}), {}),
+        ]
+
+    def client(self):
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        return client
+
+    def delete(self):
+        # Undo `seed` for fixtures that had to be committed
+        Order.objects.filter(customer__user__username__startswith=f'{self.prefix}-').delete()
+        Product.objects.filter(name__startswith=f'{self.prefix} ').delete()
+        User.objects.filter(username__startswith=f'{self.prefix}-').delete()
+        summaries.rebuild()
+
+
+def request(client, method, url, data):
+    if method == 'get':
+        return client.get(url, data)
+    return client.post(url, data, format='json')
+
+
+def count_queries(fixture):
+    # Queries per scenario on a cold cache, with the response status
+    client, names = fixture.client(), count(10 ** 6)
+    result = {}
+    for name, method, url, payload in fixture.scenarios():
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = request(client, method, url, payload(next(names)))
+        result[name] = {'queries': len(queries), 'status': response.status_code}
+    return result
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def measure(fixture, iterations=50, warmup=3):
+    """
+    Throughput and latency percentiles per scenario. Reads after the first
+    one may be served from the product cache, as in production.
+    """
+    client, names = fixture.client(), count()
+    queries = count_queries(fixture)
+    endpoints = {}
+    for name, method, url, payload in fixture.scenarios():
+        for _ in range(warmup):
+            request(client, method, url, payload(next(names)))
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            request(client, method, url, payload(next(names)))
+            latencies.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - started
+        endpoints[name] = {
+            **queries[name],
+            'budget': QUERY_BUDGETS.get(name),
+            'iterations': iterations,
+            **summarize(latencies, elapsed),
+        }
+    return {**environment(fixture), 'endpoints': endpoints}
+
+
+def summarize(latencies, elapsed):
+    return {
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        **{f'p{pct}_ms': round(percentile(latencies, pct), 3) for pct in PERCENTILES},
+        'max_ms': round(max(latencies), 3),
+    }
+
+
+def environment(fixture):
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'scale': fixture.scale,
+    }
+
+
+# Sync (WSGI) vs async (ASGI) deployments. Requests go straight into Django's
+# own WSGIHandler and ASGIHandler, as a server would hand them over, so both
+# sides pay for the full middleware stack and per-request connection
+# handling but not for a network hop.
+
+def wsgi_get(app, path, query, headers):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        **{f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()},
+    }
+    statuses = []
+    body = app(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_get(app, path, query, headers):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')] + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    sent, disconnected = [], asyncio.Event()
+
+    async def receive():
+        # The body, then nothing until the handler is done listening for a disconnect
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    statuses = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+
+def load_wsgi(app, path, query, headers, requests, concurrency):
+    # `requests` GETs from `concurrency` worker threads, as a threaded WSGI server runs them
+    def get(_):
+        started = time.perf_counter()
+        status = wsgi_get(app, path, query, headers)
+        return (time.perf_counter() - started) * 1000, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(get, range(requests)))
+    return results, time.perf_counter() - started
+
+
+async def load_asgi(app, path, query, headers, requests, concurrency):
+    # The same load as `concurrency` concurrent tasks on one event loop
+    slots = asyncio.Semaphore(concurrency)
+
+    async def get():
+        async with slots:
+            started = time.perf_counter()
+            status = await asgi_get(app, path, query, headers)
+            return (time.perf_counter() - started) * 1000, status
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(get() for _ in range(requests)))
+    return results, time.perf_counter() - started
+
+
+def load_summary(results, elapsed, concurrency):
+    return {
+        'requests': len(results),
+        'concurrency': concurrency,
+        'errors': sum(status != 200 for _, status in results),
+        **summarize([latency for latency, _ in results], elapsed),
+    }
+
+
+def compare_deployments(fixture, requests=500, concurrency=32, warmup=5):
+    """
+    Concurrent read throughput and latency of each read endpoint served
+    synchronously under WSGI and by the async views under ASGI. The fixture
+    must be committed, as requests run on their own connections. The async
+    views have no response cache, so the sync product views run without
+    theirs too and both sides do the same work.
+    """
+    token, _ = Token.objects.get_or_create(user=fixture.admin)
+    headers = {'Authorization': f'Token {token.key}'}
+    wsgi, asgi = get_wsgi_application(), get_asgi_application()
+    endpoints = {}
+    cache.clear()
+    # A timeout of 0 stores nothing
+    with override_settings(API_CACHE_TIMEOUT=0):
+        for name, sync_path, async_path, params in fixture.read_scenarios():
+            query = urlencode(params)
+            load_wsgi(wsgi, sync_path, query, headers, warmup, 1)
+            asyncio.run(load_asgi(asgi, async_path, query, headers, warmup, 1))
+            endpoints[name] = {
+                'wsgi': load_summary(*load_wsgi(wsgi, sync_path, query, headers, requests, concurrency), concurrency),
+                'asgi': load_summary(*asyncio.run(load_asgi(asgi, async_path, query, headers, requests, concurrency)), concurrency),
+            }
+    return {**environment(fixture), 'endpoints': endpoints}
+
+
+def over_budget(results):
+    return {
+        name: endpoint for name, endpoint in results['endpoints'].items()
+        if endpoint['budget'] is not None and endpoint['queries'] > endpoint['budget']
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+# Connection modes (see api.pooling)
+
+def load_threads(call, requests, concurrency):
+    """
+    `requests` calls spread over `concurrency` threads, as a threaded WSGI
+    server's workers would make them, each thread closing its connections
+    when done. Returns ((ms, status) per call, elapsed seconds).
+    """
+    results, lock = [], threading.Lock()
+
+    def work(calls):
+        try:
+            for _ in range(calls):
+                started = time.perf_counter()
+                status = call()
+                with lock:
+                    results.append(((time.perf_counter() - started) * 1000, status))
+        finally:
+            connections.close_all()
+
+    shares = [requests // concurrency + (n < requests % concurrency) for n in range(concurrency)]
+    threads = [threading.Thread(target=work, args=(calls,)) for calls in shares if calls]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def compare_connection_modes(fixture, modes=pooling.MODES, requests=300, concurrency=8):
+    """
+    Latency, throughput and connections opened per request of the sync read
+    endpoints under each connection mode, plus each mode's mean per-request
+    overhead over the cheapest. Settings are restored afterwards. The fixture
+    must be committed, as requests run on their own connections.
+    """
+    token, _ = Token.objects.get_or_create(user=fixture.admin)
+    headers = {'Authorization': f'Token {token.key}'}
+    wsgi = get_wsgi_application()
+    original = {alias: copy.deepcopy(connections.settings[alias]) for alias in connections}
+    results = {}
+    try:
+        for mode in modes:
+            if mode == pooling.MODE_POOL and (connection.vendor != 'postgresql' or not pooling.pool_available()):
+                results[mode] = {'skipped': 'needs PostgreSQL with psycopg 3 and psycopg_pool'}
+                continue
+            pooling.apply_mode(mode)
+            endpoints = {}
+            for name, path, _, params in fixture.read_scenarios():
+                query = urlencode(params)
+                before = pooling.counters.snapshot()
+                load = load_threads(lambda: wsgi_get(wsgi, path, query, headers), requests, concurrency)
+                opened = pooling.counters.snapshot()['opened'].get('default', 0) - before['opened'].get('default', 0)
+                endpoints[name] = {
+                    **load_summary(*load, concurrency),
+                    'connections_per_request': round(opened / requests, 3),
+                }
+            results[mode] = {
+                'mean_ms': round(statistics.fmean(endpoint['mean_ms'] for endpoint in endpoints.values()), 3),
+                'connections_per_request': round(statistics.fmean(
+                    endpoint['connections_per_request'] for endpoint in endpoints.values()
+                ), 3),
+                'pool': pooling.pool_stats('default'),
+                'endpoints': endpoints,
+            }
+    finally:
+        for alias, settings_dict in original.items():
+            pooling.apply_mode(pooling.MODE_NONE, [alias])
+            connections.settings[alias].clear()
+            connections.settings[alias].update(settings_dict)
+
+    measured = [result['mean_ms'] for result in results.values() if 'mean_ms' in result]
+    for result in results.values():
+        if 'mean_ms' in result:
+            result['overhead_ms'] = round(result['mean_ms'] - min(measured), 3)
+    return {**environment(fixture), 'requests': requests, 'concurrency': concurrency, 'modes': results}
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRODUCTS = 'products'
+# Customers and sellers, with their users, as order responses show them
+PARTIES = 'parties'
+
+# Process-local hit/miss counters per cache prefix, for sizing the cache
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def _count(prefix, outcome):
+    with _counters_lock:
+        counters = _counters.setdefault(prefix, {'hits': 0, 'misses': 0, 'invalidations': 0})
+        counters[outcome] += 1
+
+
+def stats(prefix=None):
+    with _counters_lock:
+        if prefix is not None:
+            return dict(_counters.get(prefix, {'hits': 0, 'misses': 0, 'invalidations': 0}))
+        return {name: dict(counters) for name, counters in _counters.items()}
+
+
+def get_version(prefix):
+    version = cache.get(f'{prefix}:version')
+    if version is None:
+        # Start from the clock so a flushed cache never hands out a version
+        # that process-local state built on the old one still remembers;
+        # add() so concurrent first readers agree on it.
+        cache.add(f'{prefix}:version', time.time_ns(), timeout=None)
+        version = cache.get(f'{prefix}:version')
+    return version
+
+
+def bump_version(prefix):
+    # Every key embeds the version, so bumping it orphans all cached entries
+    # for the prefix at once; they then age out by their own timeout.
+    try:
+        cache.incr(f'{prefix}:version')
+    except ValueError:
+        cache.add(f'{prefix}:version', time.time_ns(), timeout=None)
+    # Replicas may not have the write yet; see is_fresh()
+    cache.set(f'{prefix}:bumped', 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+    _count(prefix, 'invalidations')
+
+
+def is_fresh(prefix):
+    # Whether the prefix was bumped within REPLICA_STICKY_SECONDS, so that a
+    # replica may still hold the data of the version before
+    return cache.get(f'{prefix}:bumped') is not None
+
+
+def make_key(prefix, kind, params=()):
+    digest = hashlib.md5(urlencode(sorted(params), doseq=True).encode()).hexdigest()
+    return f'{prefix}:v{get_version(prefix)}:{kind}:{digest}'
+
+
+def get_cached(key, prefix):
+    value = cache.get(key)
+    _count(prefix, 'misses' if value is None else 'hits')
+    return value
+
+
+def set_cached(key, value, timeout=None):
+    cache.set(key, value, getattr(settings, 'API_CACHE_TIMEOUT', 300) if timeout is None else timeout)
@@ -0,0 +1,118 @@
+import csv
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .models import Order
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+
+
+class CSVRenderer(JSONRenderer):
+    # Lets ?format=csv / Accept: text/csv through content negotiation; exports
+    # stream their own body, so this only ever renders error responses.
+    media_type = 'text/csv'
+    format = FORMAT_CSV
+
+
+class NDJSONRenderer(JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = FORMAT_NDJSON
+
+
+RENDERERS = [CSVRenderer, NDJSONRenderer]
+
+
+def get_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+class Echo:
+    # csv.writer target that hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, fields, chunk_size=None, extra=None):
+    """
+    Yield `fields` of every row as a dict, reading `chunk_size` rows at a
+    time through a server-side cursor where the database has one. `extra`,
+    if given, is called with each chunk of rows to add fields that need a
+    second query (one per chunk, never per row).
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    rows = queryset.prefetch_related(None).values(*fields).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        if extra is not None:
+            extra(chunk)
+        yield from chunk
+
+
+def add_product_ids(rows):
+    # `extra` for order exports: one through-table query per chunk
+    product_ids = {row['id']: [] for row in rows}
+    links = Order.products.through.objects.filter(order_id__in=product_ids).order_by('order_id', 'product_id')
+    for order_id, product_id in links.values_list('order_id', 'product_id'):
+        product_ids[order_id].append(product_id)
+    for row in rows:
+        row['product_ids'] = product_ids[row['id']]
+
+
+def csv_value(value):
+    if isinstance(value, list):
+        return ';'.join(map(str, value))
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([csv_value(row[column]) for column in columns])
+
+
+def iter_ndjson(rows, columns):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode({column: row[column] for column in columns}) + '\n'
+
+
+def iter_json_list(queryset, serialize, chunk_size):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    objects = queryset.iterator(chunk_size=chunk_size)
+    separator = ''
+    yield '['
+    while chunk := list(islice(objects, chunk_size)):
+        for row in serialize(chunk):
+            yield separator + encoder.encode(row)
+            separator = ','
+    yield ']'
+
+
+def stream_list(queryset, serialize, chunk_size=None):
+    """
+    A JSON list response of every object in `queryset`, passed to
+    `serialize` `chunk_size` objects at a time as they are read, so neither
+    the objects nor their representations are ever all in memory.
+    """
+    return StreamingHttpResponse(iter_json_list(queryset, serialize, chunk_size or get_chunk_size()), content_type='application/json')
+
+
+def stream(rows, columns, export_format, filename):
+    if export_format == FORMAT_NDJSON:
+        body, content_type = iter_ndjson(rows, columns), NDJSONRenderer.media_type
+    else:
+        body, content_type = iter_csv(rows, columns), CSVRenderer.media_type
+        export_format = FORMAT_CSV
+    response = StreamingHttpResponse(body, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,81 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, F, Value, When
+
+from . import cache
+from .models import Order
+
+PREFIX = 'order-facets'
+
+# Params that page or sort the order list without changing which orders match
+IGNORED_PARAMS = {'cursor', 'page_size', 'ordering', 'top', 'format', 'facets'}
+
+
+def get_amount_edges():
+    return sorted(Decimal(str(edge)) for edge in getattr(settings, 'ORDER_FACET_AMOUNT_BUCKETS', [10, 50, 100, 500, 1000]))
+
+
+def get_limit():
+    return getattr(settings, 'ORDER_FACET_LIMIT', 20)
+
+
+def get_timeout():
+    return getattr(settings, 'ORDER_FACET_CACHE_TIMEOUT', 30)
+
+
+def top_values(rows, key, limit):
+    # The `limit` most frequent values, ties by id
+    rows = rows.order_by('-count', key)[:limit]
+    return [{'id': row[key], 'name': row['name'], 'count': row['count']} for row in rows]
+
+
+def amount_buckets(orders):
+    # One bucket per gap between ORDER_FACET_AMOUNT_BUCKETS edges, plus the
+    # two open-ended ones; empty buckets are listed too
+    edges = get_amount_edges()
+    bucket = Case(
+        *(When(amount__lt=edge, then=Value(index)) for index, edge in enumerate(edges)),
+        default=Value(len(edges)),
+    )
+    counts = dict(orders.annotate(bucket=bucket).values('bucket').annotate(count=Count('pk')).order_by().values_list('bucket', 'count'))
+    bounds = [None, *(f'{edge:.2f}' for edge in edges), None]
+    return [
+        {'from': bounds[index], 'to': bounds[index + 1], 'count': counts.get(index, 0)}
+        for index in range(len(edges) + 1)
+    ]
+
+
+def compute(queryset):
+    """
+    Counts of the orders in `queryset` per seller, customer and product (the
+    ORDER_FACET_LIMIT most frequent of each) and per amount bucket, in four
+    grouped queries however many orders match. Orders are matched by id, so
+    filters that join and de-duplicate never count an order twice.
+    """
+    ids = queryset.order_by().values('pk')
+    orders = Order.objects.filter(pk__in=ids)
+    limit = get_limit()
+    lines = Order.products.through.objects.filter(order_id__in=ids)
+    return {
+        'seller': top_values(orders.values('seller_id', name=F('seller__name')).annotate(count=Count('pk')), 'seller_id', limit),
+        'customer': top_values(orders.values('customer_id', name=F('customer__name')).annotate(count=Count('pk')), 'customer_id', limit),
+        'product': top_values(lines.values('product_id', name=F('product__name')).annotate(count=Count('order_id')), 'product_id', limit),
+        'amount': amount_buckets(orders),
+    }
+
+
+def get_facets(queryset, scope, params):
+    """
+    compute() for `queryset`, cached for ORDER_FACET_CACHE_TIMEOUT seconds
+    under the filter params and `scope`, which names whose orders the
+    queryset was limited to. Not invalidated by writes, so counts may lag
+    them by up to the timeout.
+    """
+    params = [(key, value) for key, value in params if key not in IGNORED_PARAMS]
+    key = cache.make_key(PREFIX, scope, params)
+    facets = cache.get_cached(key, PREFIX)
+    if facets is None:
+        facets = compute(queryset)
+        cache.set_cached(key, facets, get_timeout())
+    return facets
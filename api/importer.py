@@ -0,0 +1,578 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from . import cache
+from .models import Product, ProductImportRun, ProductImportChunk
+
+NAME_COLUMN = 'product_name'
+AMOUNT_COLUMN = 'amount'
+DEFAULT_CHUNK_SIZE = 5000
+# Tries at writing a chunk whose names another import inserts in another case meanwhile
+UPSERT_ATTEMPTS = 3
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.skipped_file = False
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    COUNTERS = ('rows', 'inserted', 'updated', 'unchanged', 'skipped', 'duplicates')
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for field in cls.COUNTERS:
+            setattr(stats, field, data.get(field, 0))
+        return stats
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'skipped': self.skipped,
+            'duplicates': self.duplicates,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'skipped_file': self.skipped_file,
+        }
+
+    def __str__(self):
+        if self.skipped_file:
+            return 'source unchanged since the last import, nothing to do'
+        return (
+            f'{self.rows} rows: {self.inserted} inserted, {self.updated} updated, '
+            f'{self.unchanged} unchanged, {self.skipped} skipped, '
+            f'{self.duplicates} duplicates '
+            f'in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)'
+        )
+
+
+def column_indexes(header):
+    header = [str(cell).strip() if cell is not None else '' for cell in header]
+    try:
+        return header.index(NAME_COLUMN), header.index(AMOUNT_COLUMN)
+    except ValueError:
+        raise ValueError(f"Expected '{NAME_COLUMN}' and '{AMOUNT_COLUMN}' columns, got {header}")
+
+
+def iter_excel_rows(file_path, start=0, stop=None, offset=None):
+    # openpyxl's read-only mode streams the sheet instead of loading the
+    # workbook, but still parses every row before `start`; `offset` is unused
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        name_index, amount_index = column_indexes(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+        max_row = None if stop is None else stop + 1
+        for row in sheet.iter_rows(min_row=start + 2, max_row=max_row, values_only=True):
+            yield row[name_index], row[amount_index]
+    finally:
+        workbook.close()
+
+
+def iter_csv_rows(file_path, start=0, stop=None, offset=None):
+    # With `offset`, the byte offset of row `start` (see scan_offsets), seeks
+    # there instead of reading every row before it
+    with open(file_path, newline='', encoding='utf-8-sig') as source:
+        reader = csv.reader(source)
+        name_index, amount_index = column_indexes(next(reader, ()))
+        if offset is not None:
+            source.seek(offset)
+            start, stop = 0, None if stop is None else stop - start
+        for row in itertools.islice(reader, start, stop):
+            yield tuple(row[index] if index < len(row) else None for index in (name_index, amount_index))
+
+
+def iter_ndjson_rows(file_path, start=0, stop=None, offset=None):
+    with open(file_path, encoding='utf-8') as source:
+        if offset is not None:
+            source.seek(offset)
+            start, stop = 0, None if stop is None else stop - start
+        lines = (line for line in source if line.strip())
+        for line in itertools.islice(lines, start, stop):
+            record = json.loads(line)
+            yield record.get(NAME_COLUMN), record.get(AMOUNT_COLUMN)
+
+
+def iter_parquet_rows(file_path, start=0, stop=None, offset=None, batch_size=DEFAULT_CHUNK_SIZE):
+    # Only the row groups overlapping [start, stop) are read; `offset` is unused
+    parquet = import_pyarrow_parquet()
+    source = parquet.ParquetFile(file_path)
+    row_groups, position, group_start = [], None, 0
+    for index in range(source.metadata.num_row_groups):
+        group_stop = group_start + source.metadata.row_group(index).num_rows
+        if group_stop > start and (stop is None or group_start < stop):
+            row_groups.append(index)
+            position = group_start if position is None else position
+        group_start = group_stop
+    if not row_groups:
+        return
+    batches = source.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=[NAME_COLUMN, AMOUNT_COLUMN])
+    for batch in batches:
+        batch_start, position = position, position + batch.num_rows
+        if position <= start:
+            continue
+        if stop is not None and batch_start >= stop:
+            break
+        columns = batch.to_pydict()
+        rows = zip(columns[NAME_COLUMN], columns[AMOUNT_COLUMN])
+        first = max(start - batch_start, 0)
+        last = None if stop is None else stop - batch_start
+        yield from itertools.islice(rows, first, last)
+
+
+def import_pyarrow_parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured('Parquet product files require pyarrow to be installed')
+    return pyarrow.parquet
+
+
+def count_excel_rows(file_path):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        # The stored dimensions are free to read but optional in the format
+        if sheet.max_row is not None:
+            return max(sheet.max_row - 1, 0)
+    finally:
+        workbook.close()
+    return sum(1 for _ in iter_excel_rows(file_path))
+
+
+def count_parquet_rows(file_path):
+    return import_pyarrow_parquet().ParquetFile(file_path).metadata.num_rows
+
+
+READERS = {
+    'xlsx': iter_excel_rows,
+    'csv': iter_csv_rows,
+    'ndjson': iter_ndjson_rows,
+    'parquet': iter_parquet_rows,
+}
+
+EXTENSIONS = {
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+
+def detect_format(file_path):
+    extension = os.path.splitext(str(file_path))[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+    with open(file_path, 'rb') as source:
+        head = source.read(4)
+    if head.startswith(b'PK'):
+        return 'xlsx'
+    if head == b'PAR1':
+        return 'parquet'
+    if head.lstrip().startswith(b'{'):
+        return 'ndjson'
+    return 'csv'
+
+
+def iter_rows(file_path, start=0, stop=None, offset=None):
+    # Data rows [start, stop) of any supported file as (name, amount) tuples;
+    # `offset` is row `start`'s byte offset in CSV and NDJSON files
+    return READERS[detect_format(file_path)](file_path, start, stop, offset)
+
+
+def count_rows(file_path):
+    file_format = detect_format(file_path)
+    if file_format == 'xlsx':
+        return count_excel_rows(file_path)
+    if file_format == 'parquet':
+        return count_parquet_rows(file_path)
+    return sum(1 for _ in iter_rows(file_path))
+
+
+def iter_lines(binary):
+    # The lines of a binary file, each with the byte offset just past it
+    position = 0
+    for line in binary:
+        position += len(line)
+        yield line, position
+
+
+def scan_offsets(file_path, chunk_size):
+    """
+    The row count of a CSV or NDJSON file and the byte offset of every
+    `chunk_size`th data row, in one pass; iter_rows() seeks straight to them.
+    """
+    file_format = detect_format(file_path)
+    offsets, rows = [], 0
+    with open(file_path, 'rb') as binary:
+        lines = iter_lines(binary)
+        if file_format == 'csv':
+            # csv.reader pulls only the lines of the record it returns, so
+            # `position` is where the next record starts
+            position = 0
+
+            def text_lines():
+                nonlocal position
+                for line, position in lines:
+                    yield line.decode('utf-8-sig' if position == len(line) else 'utf-8')
+
+            reader = csv.reader(text_lines())
+            next(reader, None)
+            start = position
+            for _ in reader:
+                if rows % chunk_size == 0:
+                    offsets.append(start)
+                rows += 1
+                start = position
+        elif file_format == 'ndjson':
+            start = 0
+            for line, position in lines:
+                if line.strip():
+                    if rows % chunk_size == 0:
+                        offsets.append(start)
+                    rows += 1
+                start = position
+        else:
+            raise ValueError(f'Cannot scan {file_format} files for offsets')
+    return rows, offsets
+
+
+def chunked(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_chunks(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    return chunked(iter_rows(file_path), chunk_size)
+
+
+def normalize_row(name, amount):
+    # Returns (name, Decimal amount), or None for rows that can't be imported
+    if name is None or amount is None:
+        return None
+    name = str(name).strip()
+    if not name:
+        return None
+    try:
+        amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+    if not amount.is_finite():
+        return None
+    return name, amount
+
+
+def name_key(name):
+    # What product names are unique on, as the Lower('name') constraint sees them
+    return name.lower()
+
+
+def existing_products(keys=None):
+    # name_key -> (stored name, amount), for `keys` or every product
+    products = Product.objects.all()
+    if keys is not None:
+        products = products.annotate(key=Lower('name')).filter(key__in=list(keys))
+    return {name_key(name): (name, amount) for name, amount in products.values_list('name', 'amount')}
+
+
+def upsert_chunk(rows, stats, existing=None):
+    # Later rows win, matching the old row-by-row update_or_create behaviour.
+    # Names that differ only in case are the same product; an existing
+    # product keeps its stored spelling. `existing` is an optional preloaded
+    # existing_products() map, kept up to date with what gets written;
+    # without it the chunk's names are looked up.
+    latest = {}
+    for row in rows:
+        stats.rows += 1
+        normalized = normalize_row(*row)
+        if normalized is None:
+            stats.skipped += 1
+            continue
+        name, amount = normalized
+        key = name_key(name)
+        if key in latest:
+            stats.duplicates += 1
+            name = latest[key][0]
+        latest[key] = (name, amount)
+    if not latest:
+        return
+
+    if existing is None:
+        existing = existing_products(latest)
+    for attempt in range(UPSERT_ATTEMPTS):
+        changed, counts = plan_upsert(latest, existing)
+        if not changed:
+            break
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=['name'],
+                    update_fields=['amount', 'updated_at'],
+                )
+            break
+        except IntegrityError:
+            # ON CONFLICT (name) only matches the exact spelling, so a case
+            # variant committed by a concurrent import since the lookup hits
+            # the Lower('name') constraint; look the names up again
+            if attempt == UPSERT_ATTEMPTS - 1:
+                raise
+            existing.update(existing_products(latest))
+    for field, count in counts.items():
+        setattr(stats, field, getattr(stats, field) + count)
+    if changed:
+        existing.update((name_key(product.name), (product.name, product.amount)) for product in changed)
+        transaction.on_commit(lambda: cache.bump_version(cache.PRODUCTS))
+
+
+def plan_upsert(latest, existing):
+    # The products `latest` needs written given `existing`, and how many rows
+    # that inserts, updates and leaves unchanged
+    changed, counts = [], {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for key, (name, amount) in latest.items():
+        current = existing.get(key)
+        if current is None:
+            counts['inserted'] += 1
+        elif current[1] != amount:
+            counts['updated'] += 1
+            name = current[0]
+        else:
+            counts['unchanged'] += 1
+            continue
+        changed.append(Product(name=name, amount=amount))
+    return changed, counts
+
+
+def import_rows(chunks):
+    stats = ImportStats()
+    for rows in chunks:
+        upsert_chunk(rows, stats)
+    return stats.finish()
+
+
+def import_products(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    return import_rows(read_chunks(file_path, chunk_size))
+
+
+def fingerprint(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def import_products_incremental(file_path, chunk_size=DEFAULT_CHUNK_SIZE, force=False):
+    """
+    Import only what changed since the last successful run of `file_path`.
+
+    The file is skipped entirely when its fingerprint matches that run. Otherwise
+    rows are diffed against the current name -> amount map and only new or changed
+    products are written. Each chunk commits together with its progress in the
+    ProductImportRun manifest, so a retried run resumes after the last committed
+    chunk instead of writing it again.
+    """
+    source = str(file_path)
+    digest = fingerprint(file_path)
+    last_run = ProductImportRun.objects.filter(source=source, parallel=False).order_by('-started_at', '-id').first()
+
+    same_file = last_run is not None and last_run.fingerprint == digest
+    if same_file and last_run.status == ProductImportRun.SUCCEEDED and not force:
+        stats = ImportStats()
+        stats.skipped_file = True
+        return stats.finish()
+    if same_file and last_run.status != ProductImportRun.SUCCEEDED:
+        run = last_run
+    else:
+        run = ProductImportRun.objects.create(source=source, fingerprint=digest, chunk_size=chunk_size)
+
+    run.status = ProductImportRun.RUNNING
+    run.save(update_fields=['status'])
+
+    stats = ImportStats.from_dict(run.stats)
+    existing = existing_products()
+    try:
+        for index, rows in enumerate(read_chunks(file_path, run.chunk_size)):
+            if index < run.chunks_done:
+                continue
+            with transaction.atomic():
+                upsert_chunk(rows, stats, existing)
+                run.chunks_done = index + 1
+                run.stats = stats.as_dict()
+                run.save(update_fields=['chunks_done', 'stats'])
+    except Exception:
+        run.status = ProductImportRun.FAILED
+        run.save(update_fields=['status'])
+        raise
+
+    stats.finish()
+    run.status = ProductImportRun.SUCCEEDED
+    run.stats = stats.as_dict()
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'stats', 'finished_at'])
+    return stats
+
+
+def plan_ranges(total_rows, chunk_size):
+    return [(start, min(start + chunk_size, total_rows)) for start in range(0, total_rows, chunk_size)]
+
+
+def plan_parallel_import(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Create a run manifest with one ProductImportChunk per row range of `file_path`.
+
+    Chunks are imported independently and in no particular order, so when a name
+    appears in more than one chunk it is undefined which amount wins. Each chunk
+    must read its range without reading the rows before it, so CSV and NDJSON
+    chunks record their byte offset and Parquet chunks read only their row
+    groups; workbooks can't be read that way and are refused.
+    """
+    file_format = detect_format(file_path)
+    if file_format == 'xlsx':
+        raise ValueError(
+            'Parallel imports need a CSV, NDJSON or Parquet file; convert the workbook '
+            'with `python manage.py convert_products` first'
+        )
+    if file_format == 'parquet':
+        ranges = plan_ranges(count_rows(file_path), chunk_size)
+        offsets = [None] * len(ranges)
+    else:
+        total_rows, offsets = scan_offsets(file_path, chunk_size)
+        ranges = plan_ranges(total_rows, chunk_size)
+    with transaction.atomic():
+        run = ProductImportRun.objects.create(
+            source=str(file_path), fingerprint=fingerprint(file_path), chunk_size=chunk_size, parallel=True,
+        )
+        ProductImportChunk.objects.bulk_create([
+            ProductImportChunk(run=run, index=index, start=start, stop=stop, offset=offset)
+            for index, ((start, stop), offset) in enumerate(zip(ranges, offsets))
+        ])
+    return run
+
+
+def import_chunk(chunk_id):
+    # Idempotent: a chunk that already committed just returns its stored stats
+    chunk = ProductImportChunk.objects.select_related('run').get(pk=chunk_id)
+    if chunk.status == ProductImportChunk.SUCCEEDED:
+        return chunk.stats
+    ProductImportChunk.objects.filter(pk=chunk.pk).update(attempts=F('attempts') + 1)
+
+    stats = ImportStats()
+    try:
+        rows = list(iter_rows(chunk.run.source, chunk.start, chunk.stop, chunk.offset))
+        with transaction.atomic():
+            upsert_chunk(rows, stats)
+            stats.finish()
+            chunk.status = ProductImportChunk.SUCCEEDED
+            chunk.stats = stats.as_dict()
+            chunk.finished_at = timezone.now()
+            chunk.save(update_fields=['status', 'stats', 'finished_at'])
+            ProductImportRun.objects.filter(pk=chunk.run_id).update(chunks_done=F('chunks_done') + 1)
+    except Exception:
+        ProductImportChunk.objects.filter(pk=chunk.pk).update(status=ProductImportChunk.FAILED)
+        raise
+    return chunk.stats
+
+
+def finish_parallel_import(run_id):
+    # Sum the committed chunks into the run; the run succeeds once all of them have
+    run = ProductImportRun.objects.get(pk=run_id)
+    chunks = list(run.chunks.all())
+    stats = ImportStats()
+    for chunk in chunks:
+        if chunk.status == ProductImportChunk.SUCCEEDED:
+            for field in ImportStats.COUNTERS:
+                setattr(stats, field, getattr(stats, field) + chunk.stats.get(field, 0))
+    stats.elapsed = (timezone.now() - run.started_at).total_seconds()
+    summary = stats.as_dict()
+    summary['chunks'] = len(chunks)
+    summary['chunks_done'] = sum(chunk.status == ProductImportChunk.SUCCEEDED for chunk in chunks)
+    summary['chunks_failed'] = sum(chunk.status == ProductImportChunk.FAILED for chunk in chunks)
+
+    run.stats = summary
+    update_fields = ['stats']
+    if summary['chunks_done'] == summary['chunks']:
+        run.status = ProductImportRun.SUCCEEDED
+        run.finished_at = timezone.now()
+        update_fields += ['status', 'finished_at']
+    run.save(update_fields=update_fields)
+    return summary
+
+
+def write_rows(rows, output_path, file_format=None, batch_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream (name, amount) rows into a CSV, NDJSON or Parquet file. Amounts are
+    written as strings so no precision is lost on the way back in.
+    """
+    file_format = file_format or EXTENSIONS.get(os.path.splitext(str(output_path))[1].lower())
+    written = 0
+    if file_format == 'csv':
+        with open(output_path, 'w', newline='', encoding='utf-8') as target:
+            writer = csv.writer(target)
+            writer.writerow([NAME_COLUMN, AMOUNT_COLUMN])
+            for name, amount in rows:
+                writer.writerow([name, amount])
+                written += 1
+    elif file_format == 'ndjson':
+        with open(output_path, 'w', encoding='utf-8') as target:
+            for name, amount in rows:
+                target.write(json.dumps({NAME_COLUMN: name, AMOUNT_COLUMN: None if amount is None else str(amount)}) + '\n')
+                written += 1
+    elif file_format == 'parquet':
+        import_pyarrow_parquet()
+        import pyarrow
+
+        schema = pyarrow.schema([(NAME_COLUMN, pyarrow.string()), (AMOUNT_COLUMN, pyarrow.string())])
+        with pyarrow.parquet.ParquetWriter(output_path, schema) as writer:
+            for batch in chunked(rows, batch_size):
+                names, amounts = zip(*batch)
+                writer.write_table(pyarrow.table({
+                    NAME_COLUMN: [None if name is None else str(name) for name in names],
+                    AMOUNT_COLUMN: [None if amount is None else str(amount) for amount in amounts],
+                }, schema=schema))
+                written += len(batch)
+    else:
+        raise ValueError(f'Cannot write product files as {file_format!r}; use csv, ndjson or parquet')
+    return written
@@ -0,0 +1,184 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('api.requests')
+slow_logger = logging.getLogger('api.slow_requests')
+
+# Upper bounds in ms of the latency histogram buckets; the last one is open
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, max_queries, track_db=True):
+        self.started = time.perf_counter()
+        self.track_db = track_db
+        self.db_count = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.max_queries = max_queries
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_count += 1
+            self.db_seconds += elapsed
+            if len(self.queries) < self.max_queries:
+                self.queries.append((sql, round(elapsed * 1000, 3)))
+
+    def as_dict(self, request, response):
+        total = time.perf_counter() - self.started
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name(request),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'db_queries': self.db_count if self.track_db else None,
+            'db_ms': round(self.db_seconds * 1000, 3) if self.track_db else None,
+            'serialize_ms': round(self.serialize_seconds * 1000, 3),
+            'bytes': None if response.streaming else len(response.content),
+        }
+
+
+def current():
+    return _current.get()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else None
+
+
+class Histogram:
+    """
+    Process-local latency histogram per `METHOD view name`, with query counts,
+    for spotting slow or chatty endpoints without an external APM.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, key, total_ms, db_queries, db_ms):
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'db_queries': 0, 'db_ms': 0.0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                }
+            endpoint['count'] += 1
+            endpoint['total_ms'] += total_ms
+            endpoint['max_ms'] = max(endpoint['max_ms'], total_ms)
+            endpoint['db_queries'] += db_queries
+            endpoint['db_ms'] += db_ms
+            endpoint['buckets'][bisect.bisect_left(self.buckets, total_ms)] += 1
+
+    def snapshot(self):
+        labels = [f'le_{bound}' for bound in self.buckets] + ['le_inf']
+        with self._lock:
+            return {
+                key: {
+                    'count': endpoint['count'],
+                    'mean_ms': round(endpoint['total_ms'] / endpoint['count'], 3),
+                    'max_ms': round(endpoint['max_ms'], 3),
+                    'mean_db_queries': round(endpoint['db_queries'] / endpoint['count'], 2),
+                    'mean_db_ms': round(endpoint['db_ms'] / endpoint['count'], 3),
+                    'buckets': dict(zip(labels, endpoint['buckets'])),
+                }
+                for key, endpoint in sorted(self._endpoints.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+histogram = Histogram()
+
+
+def server_timing(metrics):
+    if metrics['db_ms'] is None:
+        return f'total;dur={metrics["total_ms"]}'
+    return (
+        f'db;dur={metrics["db_ms"]};desc="{metrics["db_queries"]} queries", '
+        f'serialize;dur={metrics["serialize_ms"]}, total;dur={metrics["total_ms"]}'
+    )
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Times every request and the SQL it runs, then logs the numbers as a JSON
+    line to `api.requests`, adds them as a Server-Timing header and feeds the
+    histogram. Requests slower than REQUEST_SLOW_MS also go to
+    `api.slow_requests` with their SQL. Serializer time is reported by the
+    views (see RequestTimingMixin).
+
+    Runs natively under ASGI too, so async views stay on the event loop.
+    Their queries run on other threads' connections, so async requests are
+    timed as a whole, without the SQL breakdown.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', True):
+            return self.get_response(request)
+
+        metrics = RequestMetrics(getattr(settings, 'REQUEST_SLOW_MAX_QUERIES', 100))
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'REQUEST_INSTRUMENTATION', True):
+            return await self.get_response(request)
+
+        metrics = RequestMetrics(getattr(settings, 'REQUEST_SLOW_MAX_QUERIES', 100), track_db=False)
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics)
+
+    def report(self, request, response, metrics):
+        data = metrics.as_dict(request, response)
+        if getattr(settings, 'REQUEST_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(data)
+        histogram.observe(f'{data["method"]} {data["view"] or "unresolved"}', data['total_ms'], data['db_queries'] or 0, data['db_ms'] or 0)
+        logger.info(json.dumps(data))
+        if data['total_ms'] >= getattr(settings, 'REQUEST_SLOW_MS', 500):
+            slow_logger.warning(json.dumps({**data, 'sql': [{'sql': sql, 'ms': ms} for sql, ms in metrics.queries]}))
+        return response
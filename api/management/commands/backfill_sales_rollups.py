@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from api import rollups
+
+class Command(BaseCommand):
+    help = 'Roll up the daily sales of every complete day not rolled up yet, from the first order on the first run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Recompute the days from this date (YYYY-MM-DD) on, e.g. after orders in them changed')
+        parser.add_argument('--until', help='Stop before this date (YYYY-MM-DD); never goes past the last complete day')
+
+    def handle(self, *args, **kwargs):
+        since, until = (self.parse_date(kwargs[name]) for name in ('since', 'until'))
+        result = rollups.rebuild(since, until) if since else rollups.roll_up(until)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {result['days']} days into {result['rows']} rows, "
+            f"complete through {result['complete_through']}"
+        ))
+
+    def parse_date(self, value):
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Not a YYYY-MM-DD date: {value}')
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from api import benchmarks
+
+class Command(BaseCommand):
+    help = 'Seed scalable fixtures and measure query counts, throughput and latency per API endpoint (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--sellers', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--products-per-order', type=int, default=3)
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--fail-over-budget', action='store_true', help='Exit non-zero when an endpoint exceeds its query budget')
+
+    def handle(self, *args, **kwargs):
+        fixture = benchmarks.Fixture(
+            customers=kwargs['customers'], sellers=kwargs['sellers'], products=kwargs['products'],
+            orders=kwargs['orders'], products_per_order=kwargs['products_per_order'],
+        )
+        # Keep audit logging and per-request log lines out of the numbers
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            API_CALL_LOG_SAMPLE_RATE=0, REQUEST_INSTRUMENTATION=False,
+        ), transaction.atomic():
+            results = benchmarks.measure(fixture.seed(), kwargs['iterations'])
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'endpoint':<22}{'queries':>8}{'budget':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, endpoint in results['endpoints'].items():
+            self.stdout.write(
+                f"{name:<22}{endpoint['queries']:>8}{endpoint['budget'] or '-':>8}{endpoint['throughput_rps']:>10}"
+                f"{endpoint['p50_ms']:>10}{endpoint['p95_ms']:>10}{endpoint['p99_ms']:>10}"
+            )
+        if kwargs['output']:
+            benchmarks.write_results(results, kwargs['output'])
+            self.stdout.write(f"Results written to {kwargs['output']}")
+
+        over = benchmarks.over_budget(results)
+        if over:
+            message = ', '.join(f"{name} ({endpoint['queries']} > {endpoint['budget']})" for name, endpoint in over.items())
+            if kwargs['fail_over_budget']:
+                raise CommandError(f'Over query budget: {message}')
+            self.stderr.write(self.style.WARNING(f'Over query budget: {message}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All endpoints within their query budgets'))
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from api import benchmarks
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read throughput of the sync endpoints under WSGI and the async ones under ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--sellers', type=int, default=20)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--products-per-order', type=int, default=3)
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests per endpoint and deployment')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **kwargs):
+        fixture = benchmarks.Fixture(
+            customers=kwargs['customers'], sellers=kwargs['sellers'], products=kwargs['products'],
+            orders=kwargs['orders'], products_per_order=kwargs['products_per_order'], prefix='bench-async',
+        )
+        # Requests run on their own connections, so the fixture is committed
+        # and deleted afterwards rather than rolled back
+        fixture.seed()
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                API_CALL_LOG_SAMPLE_RATE=0, REQUEST_INSTRUMENTATION=False,
+            ):
+                results = benchmarks.compare_deployments(fixture, kwargs['requests'], kwargs['concurrency'])
+        finally:
+            fixture.delete()
+
+        self.stdout.write(f"{'endpoint':<18}{'server':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, deployments in results['endpoints'].items():
+            for server, endpoint in deployments.items():
+                self.stdout.write(
+                    f"{name:<18}{server:>7}{endpoint['errors']:>8}{endpoint['throughput_rps']:>10}"
+                    f"{endpoint['p50_ms']:>10}{endpoint['p95_ms']:>10}{endpoint['p99_ms']:>10}"
+                )
+        if kwargs['output']:
+            benchmarks.write_results(results, kwargs['output'])
+            self.stdout.write(f"Results written to {kwargs['output']}")
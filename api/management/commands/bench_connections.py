@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api import benchmarks, pooling
+
+class Command(BaseCommand):
+    help = 'Compare per-request connection overhead and churn of the sync read endpoints under each connection mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(pooling.MODES), help='Comma-separated connection modes to compare')
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--sellers', type=int, default=10)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=300, help='Timed requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=8, help='Worker threads')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **kwargs):
+        modes = [mode.strip() for mode in kwargs['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(pooling.MODES)
+        if unknown:
+            raise CommandError(f"Unknown connection modes: {', '.join(sorted(unknown))}")
+        fixture = benchmarks.Fixture(
+            customers=kwargs['customers'], sellers=kwargs['sellers'], products=kwargs['products'],
+            orders=kwargs['orders'], prefix='bench-conn',
+        )
+        # Requests run on their own connections, so the fixture is committed
+        # and deleted afterwards rather than rolled back
+        fixture.seed()
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                API_CALL_LOG_SAMPLE_RATE=0, REQUEST_INSTRUMENTATION=False,
+            ):
+                results = benchmarks.compare_connection_modes(fixture, modes, kwargs['requests'], kwargs['concurrency'])
+        finally:
+            fixture.delete()
+
+        self.stdout.write(f"{'mode':<12}{'endpoint':<18}{'conns/req':>10}{'req/s':>10}{'mean ms':>10}{'p95 ms':>10}")
+        for mode, result in results['modes'].items():
+            if 'skipped' in result:
+                self.stdout.write(f"{mode:<12}skipped: {result['skipped']}")
+                continue
+            for name, endpoint in result['endpoints'].items():
+                self.stdout.write(
+                    f"{mode:<12}{name:<18}{endpoint['connections_per_request']:>10}{endpoint['throughput_rps']:>10}"
+                    f"{endpoint['mean_ms']:>10}{endpoint['p95_ms']:>10}"
+                )
+            self.stdout.write(f"{mode:<12}{'overhead':<18}{'':>10}{'':>10}{result['overhead_ms']:>10}")
+        if kwargs['output']:
+            benchmarks.write_results(results, kwargs['output'])
+            self.stdout.write(f"Results written to {kwargs['output']}")
@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Customer, Seller, Product, Order
+from api.serializers import OrderSerializer, OrderReadSerializer
+
+class Command(BaseCommand):
+    help = 'Compare OrderSerializer with the lean OrderReadSerializer on seeded orders (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='Orders to seed')
+        parser.add_argument('--products-per-order', type=int, default=5, help='Products attached to each order')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per serializer; the best is reported')
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            self.seed(kwargs['orders'], kwargs['products_per_order'])
+            queryset = Order.objects.select_related('customer__user', 'seller__user').order_by('id')
+
+            drf = self.measure(lambda: OrderSerializer(queryset.prefetch_related('products'), many=True).data, kwargs['repeat'])
+            lean = self.measure(lambda: OrderReadSerializer(queryset, many=True).data, kwargs['repeat'])
+            if self.normalize(drf['data']) != self.normalize(lean['data']):
+                self.stderr.write(self.style.ERROR('Serializers produced different output'))
+
+            for name, result in (('OrderSerializer', drf), ('OrderReadSerializer', lean)):
+                self.stdout.write(
+                    f"{name:<20} {result['seconds'] * 1000:9.1f} ms  {result['queries']:3d} queries  "
+                    f"{len(result['data']) / result['seconds']:10.0f} orders/s"
+                )
+            self.stdout.write(self.style.SUCCESS(f"Speedup: {drf['seconds'] / lean['seconds']:.1f}x"))
+            transaction.set_rollback(True)
+
+    def seed(self, orders, products_per_order):
+        customer = Customer.objects.create(user=User.objects.create(username='bench-customer'), name='Customer', mobile='1')
+        seller = Seller.objects.create(user=User.objects.create(username='bench-seller'), name='Seller', mobile='2')
+        products = Product.objects.bulk_create([
+            Product(name=f'bench-product-{n}', amount=n + 1) for n in range(max(products_per_order * 10, 1))
+        ])
+        created = Order.objects.bulk_create([
+            Order(customer=customer, seller=seller, amount=n % 1000) for n in range(orders)
+        ])
+        Order.products.through.objects.bulk_create([
+            Order.products.through(order_id=order.id, product_id=products[(i + j) % len(products)].id)
+            for i, order in enumerate(created) for j in range(products_per_order)
+        ])
+
+    def measure(self, render, repeat):
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                data = render()
+                seconds = time.perf_counter() - started
+            if best is None or seconds < best['seconds']:
+                best = {'seconds': seconds, 'queries': len(queries), 'data': data}
+        return best
+
+    def normalize(self, data):
+        # Product order within an order is not defined by OrderSerializer
+        return [dict(order, products=sorted(order['products'], key=lambda product: product['id'])) for order in data]
\ No newline at end of file
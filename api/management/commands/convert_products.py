@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.importer import iter_rows, write_rows
+
+class Command(BaseCommand):
+    help = 'Convert a product file (e.g. an Excel catalogue) to CSV, NDJSON or Parquet for faster imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input_file', type=str, help='Path to the source file')
+        parser.add_argument('output_file', type=str, help='Path to write; the format follows the extension')
+        parser.add_argument('--format', choices=['csv', 'ndjson', 'parquet'], help='Output format, if not implied by the extension')
+
+    def handle(self, *args, **kwargs):
+        try:
+            written = write_rows(iter_rows(kwargs['input_file']), kwargs['output_file'], kwargs['format'])
+        except Exception as e:
+            raise CommandError(f'Error converting products: {e}')
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} products to {kwargs['output_file']}"))
\ No newline at end of file
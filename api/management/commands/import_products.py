@@ -1,24 +1,22 @@
 from django.core.management.base import BaseCommand
-from api.models import Product
-import pandas as pd
+from api.importer import import_products, import_products_incremental, DEFAULT_CHUNK_SIZE
 
 class Command(BaseCommand):
-    help = 'Import products from an Excel file'
+    help = 'Import products from an Excel, CSV, NDJSON or Parquet file'
 
     def add_arguments(self, parser):
-        parser.add_argument('excel_file', type=str, help='Path to the Excel file')
+        parser.add_argument('product_file', type=str, help='Path to the product file')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows upserted per statement')
+        parser.add_argument('--incremental', action='store_true', help='Skip unchanged files and write only new or changed rows')
+        parser.add_argument('--force', action='store_true', help='With --incremental, import even if the file is unchanged')
 
     def handle(self, *args, **kwargs):
-        excel_file = kwargs['excel_file']
+        product_file = kwargs['product_file']
         try:
-            df = pd.read_excel(excel_file)
-            for _, row in df.iterrows():
-                product_name = row['product_name']
-                amount = row['amount']
-                Product.objects.update_or_create(
-                    name=product_name,
-                    defaults={'amount': amount}
-                )
-            self.stdout.write(self.style.SUCCESS('Products imported successfully'))
+            if kwargs['incremental']:
+                stats = import_products_incremental(product_file, chunk_size=kwargs['chunk_size'], force=kwargs['force'])
+            else:
+                stats = import_products(product_file, chunk_size=kwargs['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'Products imported successfully: {stats}'))
         except Exception as e:
             self.stderr.write(self.style.ERROR(f'Error importing products: {e}'))
\ No newline at end of file
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api import retention
+
+class Command(BaseCommand):
+    help = 'Convert the API call log into monthly range partitions on timestamp (PostgreSQL only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None, help='Future monthly partitions to create')
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL; other databases are aged out in batches by the retention task.')
+        if retention.is_partitioned():
+            created = retention.ensure_partitions(kwargs['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f'Already partitioned; created {created} new monthly partitions'))
+            return
+        created = retention.partition_table(kwargs['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(f'Partitioned {retention.TABLE} with {created} monthly partitions'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from api import summaries
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-customer and per-seller order summaries and the top orders list from scratch'
+
+    def handle(self, *args, **kwargs):
+        counts = summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt summaries for {counts['customers']} customers and {counts['sellers']} sellers, "
+            f"{counts['top_orders']} top orders"
+        ))
\ No newline at end of file
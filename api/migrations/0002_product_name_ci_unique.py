@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:23
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_case_duplicates(apps, schema_editor):
+    # The index can't be built while names differing only in case exist;
+    # list them instead of failing on an opaque IntegrityError
+    Product = apps.get_model('api', 'Product')
+    clashes = (
+        Product.objects.using(schema_editor.connection.alias)
+        .annotate(key=Lower('name')).values('key')
+        .annotate(count=Count('id')).filter(count__gt=1)
+        .order_by('key').values_list('key', flat=True)
+    )
+    keys = list(clashes[:20])
+    if keys:
+        names = Product.objects.using(schema_editor.connection.alias).annotate(key=Lower('name')).filter(key__in=keys)
+        listing = '; '.join(
+            f'{product.name!r} (id {product.id})' for product in names.order_by('key', 'id')
+        )
+        raise RuntimeError(
+            'Product names must be unique regardless of case. Rename or merge these products '
+            f'and run the migration again: {listing}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='product_name_ci_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimportchunk',
+            name='offset',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Matches the UPPER(name::text) LIKE UPPER(...) that icontains compiles to
+CREATE_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS api_product_name_trgm_idx '
+    'ON api_product USING gin ((UPPER(name::text)) gin_trgm_ops)'
+)
+DROP_INDEX_SQL = 'DROP INDEX IF EXISTS api_product_name_trgm_idx'
+
+
+class PostgresTrigramExtension(TrigramExtension):
+    # TrigramExtension skips other databases going forwards but not backwards
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def run_on_postgresql(sql):
+    # Only PostgreSQL has trigram indexes; the in-process index serves the rest
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_productimportchunk_offset'),
+    ]
+
+    operations = [
+        PostgresTrigramExtension(),
+        migrations.RunPython(run_on_postgresql(CREATE_INDEX_SQL), run_on_postgresql(DROP_INDEX_SQL)),
+    ]
@@ -1,15 +1,182 @@
-from .models import PlatformApiCall
-from django.utils import timezone
+import hashlib
+import time
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from . import audit, cache, exports, instrumentation, replicas
+
+class RequestTimingMixin:
+    """
+    Reports the time between `initial` and `finalize_response`, less the SQL
+    run meanwhile, as serializer time to the request instrumentation: what
+    is left of a handler once auth and queries are taken out is validating
+    and representing data. Goes first in the bases so it excludes the other
+    mixins' finalize work.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        metrics = instrumentation.current()
+        if metrics is not None:
+            self.handler_started = (time.perf_counter(), metrics.db_seconds)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        metrics = instrumentation.current()
+        started = getattr(self, 'handler_started', None)
+        if metrics is not None and started is not None:
+            metrics.serialize_seconds += (time.perf_counter() - started[0]) - (metrics.db_seconds - started[1])
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class ReplicaReadMixin:
+    """
+    Reads of GET and HEAD requests go to a replica from DATABASE_REPLICAS,
+    unless the user wrote within REPLICA_STICKY_SECONDS; a request that
+    writes pins its user to the primary for that long (see api.replicas).
+    Goes before PlatformApiCallMixin, so writing the audit log never pins
+    anyone.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.replica_routing = replicas.begin(request.method in permissions.SAFE_METHODS, request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'replica_routing', None) is not None:
+            replicas.end(request.user)
+            self.replica_routing = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
 class PlatformApiCallMixin:
+    # Overrides of the API_CALL_LOG_* settings for this view, see audit.get_policy
+    api_call_log_policy = {}
+
+    def initial(self, request, *args, **kwargs):
+        self.api_call_started = time.perf_counter()
+        super().initial(request, *args, **kwargs)
+
     def finalize_response(self, request, response, *args, **kwargs):
         # Log the API call only if the user is authenticated
         if request.user.is_authenticated:
-            PlatformApiCall.objects.create(
-                user=request.user,
-                requested_url=request.build_absolute_uri(),
-                requested_data=request.data if request.method in ['POST', 'PUT', 'PATCH'] else {},
-                response_data=response.data,
-                timestamp=timezone.now()
+            audit.log_api_call(
+                request, response, audit.get_policy(self.api_call_log_policy),
+                action=getattr(self, 'action', None), started=getattr(self, 'api_call_started', None),
             )
-        return super().finalize_response(request, response, *args, **kwargs)
\ No newline at end of file
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class CachedReadMixin:
+    """
+    Cache list and retrieve responses under versioned keys built from the
+    query params. Writes to the model are expected to bump the prefix's
+    version (for products, see api.signals). Responses read from a replica
+    within REPLICA_STICKY_SECONDS of a bump are not cached.
+    """
+    cache_prefix = None
+
+    def cached_response(self, kind, params, view):
+        key = cache.make_key(self.cache_prefix, kind, params)
+        data = cache.get_cached(key, self.cache_prefix)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = view()
+        # A replica read just after a write may predate it; serve it but
+        # don't store it under the new version
+        if response.status_code == 200 and not (replicas.reads_replica() and cache.is_fresh(self.cache_prefix)):
+            cache.set_cached(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        params = list(request.query_params.lists())
+        return self.cached_response('list', params, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        params = list(kwargs.items()) + list(request.query_params.lists())
+        return self.cached_response('detail', params, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve. Validators come from a
+    count and max(`last_modified_field`) over the scoped, filtered queryset,
+    so a matching request gets a 304 without serializing anything.
+
+    Responses that nest rows of other models name those models' cache
+    prefixes in `etag_versions`; their versions join the ETag, and as they
+    carry no time such views send no Last-Modified.
+    """
+    last_modified_field = 'updated_at'
+    etag_versions = ()
+
+    def get_validators(self, queryset, params):
+        aggregates = queryset.aggregate(count=Count('pk'), last_modified=Max(self.last_modified_field))
+        last_modified = aggregates['last_modified']
+        signature = repr((
+            self.request.user.pk, sorted(params), aggregates['count'],
+            last_modified.isoformat() if last_modified else None,
+            [cache.get_version(prefix) for prefix in self.etag_versions],
+        ))
+        etag = quote_etag(hashlib.md5(signature.encode()).hexdigest())
+        return etag, None if self.etag_versions else last_modified, aggregates['count']
+
+    def not_modified(self, etag, last_modified):
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags or etag in [tag.removeprefix('W/') for tag in etags]
+        if_modified_since = parse_http_date_safe(self.request.headers.get('If-Modified-Since', ''))
+        return (
+            last_modified is not None and if_modified_since is not None
+            and int(last_modified.timestamp()) <= if_modified_since
+        )
+
+    def conditional_response(self, etag, last_modified, view):
+        if self.not_modified(etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view()
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, _, _ = self.get_validators(queryset, list(request.query_params.lists()))
+        # Deletions don't move max(updated_at), so lists are validated by ETag only
+        return self.conditional_response(etag, None, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        etag, last_modified, count = self.get_validators(queryset, list(request.query_params.lists()))
+        view = lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        if not count:
+            return view()
+        return self.conditional_response(etag, last_modified, view)
+
+class StreamingExportMixin:
+    """
+    GET `export/?format=csv|ndjson` streams every row the list would show,
+    after the view's scoping and filters, without paginating or building it
+    in memory.
+    """
+    export_fields = ()
+    export_columns = None
+    export_filename = 'export'
+
+    def export_rows(self, queryset):
+        return exports.iter_rows(queryset, self.export_fields)
+
+    @action(detail=False, methods=['get'], renderer_classes=exports.RENDERERS)
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # The rows stream after the view returns; read them from the
+        # database chosen now
+        queryset = queryset.using(queryset.db)
+        columns = self.export_columns or self.export_fields
+        return exports.stream(self.export_rows(queryset), columns, request.accepted_renderer.format, self.export_filename)
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Customer(models.Model):
@@ -18,8 +20,17 @@ class Seller(models.Model):
         return self.name
 
 class Product(models.Model):
+    # The plain unique index is what the importer's upserts conflict on
     name = models.CharField(max_length=255, unique=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Names are unique regardless of case; writes rely on this rather
+        # than looking for a clash first
+        constraints = [
+            models.UniqueConstraint(Lower('name'), name='product_name_ci_unique'),
+        ]
 
     def __str__(self):
         return self.name
@@ -30,16 +41,144 @@ class Order(models.Model):
     products = models.ManyToManyField(Product, related_name='orders')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Keyset pagination walks (ordering field, id)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+            models.Index(fields=['amount', 'id'], name='order_amount_id_idx'),
+        ]
 
     def __str__(self):
         return f'Order #{self.id} by {self.customer.name}'
 
+class OrderSummary(models.Model):
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+class CustomerOrderSummary(OrderSummary):
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='order_summary')
+
+    def __str__(self):
+        return f'Orders of {self.customer_id}'
+
+class SellerOrderSummary(OrderSummary):
+    seller = models.OneToOneField(Seller, on_delete=models.CASCADE, primary_key=True, related_name='order_summary')
+
+    def __str__(self):
+        return f'Orders of {self.seller_id}'
+
+class TopOrder(models.Model):
+    # The highest-amount orders, kept at most ORDER_SUMMARY_TOP_N rows
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
+
+    def __str__(self):
+        return f'Top order {self.order_id}'
+
+class DailySales(models.Model):
+    """
+    One day of a seller's orders (in TIME_ZONE), per product they contained;
+    the row without a product holds all of the seller's orders that day. A
+    product row's revenue is the amount of the orders containing it, so only
+    the seller rows add up to the seller's revenue. Filled by api.rollups.
+    """
+    date = models.DateField()
+    seller = models.ForeignKey(Seller, on_delete=models.CASCADE, related_name='daily_sales')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales')
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'seller', 'product'], condition=models.Q(product__isnull=False),
+                name='dailysales_product_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['date', 'seller'], condition=models.Q(product__isnull=True),
+                name='dailysales_seller_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Sales of {self.seller_id} on {self.date}'
+
+class RollupWatermark(models.Model):
+    # How far a rollup has got: orders created before `created_before` are in it
+    name = models.CharField(max_length=64, primary_key=True)
+    created_before = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.name} up to {self.created_before}'
+
 class PlatformApiCall(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     requested_url = models.URLField()
+    method = models.CharField(max_length=10, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
     requested_data = models.TextField()
     response_data = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # 'zlib' when both bodies are stored zlib-compressed and base64-encoded
+    payload_encoding = models.CharField(max_length=10, blank=True)
+    # Set by the logger at request time rather than when a buffered batch is written
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='apicall_timestamp_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'API Call by {self.user} at {self.timestamp}'
+
+class ProductImportRun(models.Model):
+    # Manifest of an incremental product import, used to skip files that were
+    # already imported and to resume a retried run after its last committed chunk.
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    source = models.CharField(max_length=1024)
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=RUNNING)
+    chunk_size = models.PositiveIntegerField()
+    parallel = models.BooleanField(default=False)
+    chunks_done = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Import of {self.source} ({self.status})'
+
+class ProductImportChunk(models.Model):
+    # One row range of a parallel import, processed by its own Celery task
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    run = models.ForeignKey(ProductImportRun, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    start = models.PositiveIntegerField()
+    stop = models.PositiveIntegerField()
+    # Byte offset of row `start` in CSV and NDJSON sources
+    offset = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    stats = models.JSONField(default=dict)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [('run', 'index')]
 
     def __str__(self):
-        return f'API Call by {self.user} at {self.timestamp}'
\ No newline at end of file
+        return f'Rows {self.start}-{self.stop} of {self.run}'
@@ -0,0 +1,156 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering field, id).
+
+    Each page is fetched with `WHERE (field, id) > (last field, last id)`
+    instead of an OFFSET, so deep pages cost the same as the first one and
+    rows inserted meanwhile never shift or repeat a page. The ordering comes
+    from the view's `ordering` param when its first field is one of
+    `cursor_fields`, otherwise from `ordering`.
+
+    Pagination only kicks in when the client sends `cursor` or `page_size`,
+    so existing unpaginated clients see the same responses as before.
+    """
+    ordering = 'created_at'
+    cursor_fields = ('created_at',)
+    page_size = 50
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # paginate_queryset for async views, reading the page with the async ORM
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        # The page plus one row, to tell whether there is another; None when
+        # this request is not paginated
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        if queryset.query.is_sliced:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_key(request, queryset, view)
+        value, self.cursor_pk, self.backwards = self.decode_cursor(request, queryset)
+
+        # Scan towards the previous page in the opposite direction and flip it back
+        scan_descending = self.descending != self.backwards
+        prefix = '-' if scan_descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}pk')
+        if self.cursor_pk is not None:
+            lookup = 'lt' if scan_descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'pk__{lookup}': self.cursor_pk})
+            )
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.backwards:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor_pk is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_key(self, request, queryset, view):
+        ordering = filters.OrderingFilter().get_ordering(request, queryset, view) if view is not None else None
+        field = ordering[0] if ordering else self.ordering
+        if field.lstrip('-') not in self.cursor_fields:
+            field = self.ordering
+        return field.lstrip('-'), field.startswith('-')
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if data['f'] != self.field:
+                raise ValueError
+            value = queryset.model._meta.get_field(self.field).to_python(data['v'])
+            return value, int(data['pk']), bool(data['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, backwards):
+        value = getattr(row, self.field)
+        data = {'f': self.field, 'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+                'pk': row.pk, 'r': backwards}
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], backwards=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OrderCursorPagination(KeysetPagination):
+    ordering = 'created_at'
+    cursor_fields = ('created_at', 'amount')
+
+
+class PlatformApiCallCursorPagination(KeysetPagination):
+    ordering = '-timestamp'
+    cursor_fields = ('timestamp',)
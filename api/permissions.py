@@ -9,5 +9,6 @@ class IsOwnerOrAdmin(permissions.BasePermission):
         # Admins can access any object
         if request.user.is_staff:
             return True
-        # Otherwise, only the owner can access
-        return obj.customer.user == request.user
+        # Otherwise, only the owner can access; compare ids so the user row
+        # is never loaded
+        return obj.customer.user_id == request.user.id
@@ -0,0 +1,111 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+MODE_NONE = 'none'
+MODE_PERSISTENT = 'persistent'
+MODE_POOL = 'pool'
+MODES = [MODE_NONE, MODE_PERSISTENT, MODE_POOL]
+
+
+class ConnectionCounters:
+    """
+    Process-local counts of database connections opened per alias and of
+    the requests and tasks served meanwhile; opened per request or task is
+    the connection churn. With a pool, each checkout counts as an open and
+    the pool's own stats give the real connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def opened(self, alias):
+        with self._lock:
+            self._opened[alias] += 1
+
+    def served(self, kind):
+        with self._lock:
+            self._served[kind] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'opened': dict(self._opened), 'requests': self._served['requests'], 'tasks': self._served['tasks']}
+
+    def reset(self):
+        with self._lock:
+            self._opened = Counter()
+            self._served = Counter()
+
+
+counters = ConnectionCounters()
+
+
+def pool_available():
+    try:
+        import psycopg  # noqa: F401
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def pool_stats(alias):
+    # psycopg_pool's statistics (size, available, waiting, wait ms...) once
+    # `alias` has opened its pool; None when it doesn't use one
+    connection = connections[alias]
+    pool = getattr(connection, '_connection_pools', {}).get(alias)
+    return pool.get_stats() if pool is not None else None
+
+
+def stats():
+    counts = counters.snapshot()
+    units = counts['requests'] + counts['tasks']
+    databases = {}
+    for alias in connections:
+        settings_dict = connections.settings[alias]
+        opened = counts['opened'].get(alias, 0)
+        databases[alias] = {
+            'conn_max_age': settings_dict.get('CONN_MAX_AGE', 0),
+            'health_checks': settings_dict.get('CONN_HEALTH_CHECKS', False),
+            'pooled': bool(settings_dict.get('OPTIONS', {}).get('pool')),
+            'opened': opened,
+            'opened_per_unit': round(opened / units, 3) if units else None,
+            'pool': pool_stats(alias),
+        }
+    return {
+        'mode': getattr(settings, 'DATABASE_POOL_MODE', MODE_NONE),
+        'requests': counts['requests'],
+        'tasks': counts['tasks'],
+        'databases': databases,
+    }
+
+
+def apply_mode(mode, aliases=None):
+    """
+    Switch `aliases` (all by default) to another connection mode at runtime,
+    as the settings would have configured them; for benchmarks. Closes this
+    thread's connections first; other threads pick the change up on their
+    next connect.
+    """
+    if mode == MODE_POOL and not pool_available():
+        raise ValueError("The 'pool' mode needs psycopg 3 and psycopg_pool")
+    for alias in aliases or list(connections):
+        connection = connections[alias]
+        connection.close()
+        settings_dict = connections.settings[alias]
+        pooled = mode == MODE_POOL and connection.vendor == 'postgresql'
+        settings_dict['CONN_MAX_AGE'] = getattr(settings, 'DATABASE_CONN_MAX_AGE', 60) if mode != MODE_NONE and not pooled else 0
+        settings_dict['CONN_HEALTH_CHECKS'] = mode != MODE_NONE
+        options = settings_dict.setdefault('OPTIONS', {})
+        if pooled:
+            options['pool'] = {
+                'min_size': getattr(settings, 'DATABASE_POOL_MIN_SIZE', 2),
+                'max_size': getattr(settings, 'DATABASE_POOL_MAX_SIZE', 10),
+                'timeout': getattr(settings, 'DATABASE_POOL_TIMEOUT', 10),
+            }
+        elif options.get('pool'):
+            connection.close_pool()
+            del options['pool']
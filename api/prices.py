@@ -0,0 +1,82 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+
+from . import cache
+from .models import Product
+
+MODE_COMPUTE = 'compute'
+MODE_VERIFY = 'verify'
+MODE_CLIENT = 'client'
+
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+class PriceCache:
+    """
+    Process-local product id -> amount map. Entries expire after `ttl`
+    seconds, and the whole map is dropped when the product cache version
+    moves (any product save or delete, or an import), so a warm lookup
+    costs no queries. Misses are fetched together in IN queries.
+    """
+
+    def __init__(self, ttl=60, batch_size=2000):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self._prices = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, ids):
+        ids = set(ids)
+        version = cache.get_version(cache.PRODUCTS)
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._prices = {}
+                self._version = version
+            prices, missing = {}, []
+            for pk in ids:
+                entry = self._prices.get(pk)
+                if entry is not None and entry[1] > now:
+                    prices[pk] = entry[0]
+                else:
+                    missing.append(pk)
+            self.hits += len(prices)
+            self.misses += len(missing)
+
+        expires = now + self.ttl
+        for start in range(0, len(missing), self.batch_size):
+            rows = Product.objects.filter(pk__in=missing[start:start + self.batch_size]).values_list('id', 'amount')
+            fetched = dict(rows)
+            prices.update(fetched)
+            with self._lock:
+                if self._version == version:
+                    self._prices.update((pk, (amount, expires)) for pk, amount in fetched.items())
+        # Ids without a product are left out of the result
+        return prices
+
+    def clear(self):
+        with self._lock:
+            self._prices = {}
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._prices), 'hits': self.hits, 'misses': self.misses}
+
+
+price_cache = PriceCache(ttl=getattr(settings, 'PRODUCT_PRICE_CACHE_TTL', 60))
+
+
+def get_mode():
+    return getattr(settings, 'ORDER_AMOUNT_MODE', MODE_COMPUTE)
+
+
+def order_amount(product_ids, prices):
+    # Each product counts once, as the M2M has no quantities
+    return sum((prices[pk] for pk in set(product_ids)), Decimal('0.00')).quantize(Decimal('0.01'))
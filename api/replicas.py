@@ -0,0 +1,93 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY = 'default'
+
+_routing = ContextVar('db_routing', default=None)
+
+
+class Routing:
+    # Where the current request reads from, and whether it has written
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def sticky_key(user):
+    return f'db:sticky:{user.pk}'
+
+
+def is_sticky(user):
+    return user.is_authenticated and cache.get(sticky_key(user)) is not None
+
+
+def stick(user):
+    # Keep the user's reads on the primary until their writes have replicated
+    cache.set(sticky_key(user), 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+def begin(read_only, user):
+    """
+    Route the rest of the current request: its reads go to one of
+    DATABASE_REPLICAS when it is `read_only` and `user` has not written within
+    REPLICA_STICKY_SECONDS, everything else to the primary.
+    """
+    replicas = get_replicas()
+    routing = Routing(random.choice(replicas) if read_only and replicas and not is_sticky(user) else None)
+    _routing.set(routing)
+    return routing
+
+
+def end(user):
+    # Stop routing; a request that wrote pins its user to the primary
+    routing = _routing.get()
+    _routing.set(None)
+    if routing is not None and routing.wrote and user.is_authenticated:
+        stick(user)
+    return routing
+
+
+def current():
+    return _routing.get()
+
+
+def reads_replica():
+    # Whether the current request's reads go to a replica right now
+    routing = _routing.get()
+    return routing is not None and routing.replica is not None and not routing.wrote
+
+
+class ReplicaRouter:
+    """
+    Sends a routed request's reads to its replica until it writes; writes,
+    and every query outside a routed request (tasks, commands, other views),
+    use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None:
+            return None
+        if routing.replica is None or routing.wrote:
+            return PRIMARY
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
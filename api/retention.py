@@ -0,0 +1,280 @@
+import gzip
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import exports
+from .models import PlatformApiCall
+
+logger = logging.getLogger(__name__)
+
+TABLE = PlatformApiCall._meta.db_table
+LEGACY_TABLE = f'{TABLE}_legacy'
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+LEGACY_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+ARCHIVE_FIELDS = [
+    'id', 'user_id', 'requested_url', 'method', 'status_code', 'duration_ms',
+    'requested_data', 'response_data', 'payload_encoding', 'timestamp',
+]
+
+
+def get_policy():
+    # Ages in days; 0 turns a tier off
+    return {
+        'payload_days': getattr(settings, 'API_CALL_PAYLOAD_RETENTION_DAYS', 0),
+        'retention_days': getattr(settings, 'API_CALL_RETENTION_DAYS', 0),
+        'archive_days': getattr(settings, 'API_CALL_ARCHIVE_RETENTION_DAYS', 0),
+        'archive_dir': getattr(settings, 'API_CALL_ARCHIVE_DIR', 'archive/api_calls'),
+        'batch_size': getattr(settings, 'API_CALL_RETENTION_BATCH_SIZE', 5000),
+    }
+
+
+def cutoff(days, now=None):
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+# Archival
+
+def write_archive(rows, archive_dir):
+    """
+    Write `rows` to a gzip NDJSON file named after their first timestamp and
+    id range, via a temporary file so a crash never leaves a partial archive
+    behind. Re-archiving the same batch overwrites the same file.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    first, last = rows[0], rows[-1]
+    name = f"api_calls-{first['timestamp']:%Y%m%dT%H%M%S}-{first['id']}-{last['id']}.ndjson.gz"
+    path = os.path.join(archive_dir, name)
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as archive:
+        archive.writelines(exports.iter_ndjson(rows, ARCHIVE_FIELDS))
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def archive_rows(queryset, policy, delete=True):
+    """
+    Archive the rows of `queryset` oldest first, `batch_size` per file, and
+    delete each batch by id once its file is in place. Without `delete` the
+    rows are walked by (timestamp, id) instead, for a partition that is
+    about to be dropped whole.
+    """
+    queryset = queryset.order_by('timestamp', 'id')
+    batch_size = policy['batch_size']
+    total, last = 0, None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(Q(timestamp__gt=last['timestamp']) | Q(timestamp=last['timestamp'], id__gt=last['id']))
+        rows = list(batch.values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return total
+        write_archive(rows, policy['archive_dir'])
+        if delete:
+            PlatformApiCall.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        else:
+            last = rows[-1]
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+
+
+def archive_expired(policy=None, now=None):
+    """
+    Archive and delete every API call older than the retention age, in
+    batches. Monthly partitions that are entirely past it are archived and
+    then dropped whole instead of deleted row by row.
+    """
+    policy = policy or get_policy()
+    if not policy['retention_days']:
+        return {'archived': 0, 'partitions_dropped': 0}
+    before = cutoff(policy['retention_days'], now)
+    archived = dropped = 0
+    for name, start, end in expired_partitions(before):
+        rows = PlatformApiCall.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        archived += archive_rows(rows, policy, delete=False)
+        drop_partition(name)
+        dropped += 1
+    archived += archive_rows(PlatformApiCall.objects.filter(timestamp__lt=before), policy)
+    return {'archived': archived, 'partitions_dropped': dropped}
+
+
+def strip_payloads(policy=None, now=None):
+    # Blank the request and response bodies of rows past the payload age,
+    # keeping their URL, user and timestamp
+    policy = policy or get_policy()
+    if not policy['payload_days']:
+        return 0
+    stale = PlatformApiCall.objects.filter(timestamp__lt=cutoff(policy['payload_days'], now)).exclude(
+        requested_data='', response_data='',
+    )
+    total = 0
+    while True:
+        ids = list(stale.order_by('timestamp', 'id').values_list('id', flat=True)[:policy['batch_size']])
+        if not ids:
+            return total
+        total += PlatformApiCall.objects.filter(pk__in=ids).update(requested_data='', response_data='', payload_encoding='')
+
+
+def prune_archives(policy=None, now=None):
+    policy = policy or get_policy()
+    if not policy['archive_days'] or not os.path.isdir(policy['archive_dir']):
+        return 0
+    oldest = (now or timezone.now()).timestamp() - policy['archive_days'] * 86400
+    removed = 0
+    for entry in os.scandir(policy['archive_dir']):
+        if entry.name.endswith('.ndjson.gz') and entry.stat().st_mtime < oldest:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+def apply(now=None):
+    # One pass of every retention tier, as run by the beat task
+    policy = get_policy()
+    started = time.monotonic()
+    result = {'partitions_created': ensure_partitions()}
+    result['payloads_stripped'] = strip_payloads(policy, now)
+    result.update(archive_expired(policy, now))
+    result['archives_removed'] = prune_archives(policy, now)
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+# Monthly range partitions (PostgreSQL)
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y%m}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s', [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions():
+    # (name, start, end) of the monthly partitions, oldest first
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s', [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    result = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            start = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            result.append((name, start, add_months(start, 1)))
+    return sorted(result, key=lambda partition: partition[1])
+
+
+def legacy_end():
+    # Where the partition holding the rows from before partitioning ends,
+    # None once it has been aged out and dropped
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE relname = %s', [LEGACY_TABLE])
+        row = cursor.fetchone()
+    match = LEGACY_BOUND.search(row[0] or '') if row else None
+    return parse_datetime(match[1]) if match else None
+
+
+def expired_partitions(before):
+    return [partition for partition in partitions() if partition[2] <= before]
+
+
+def create_partition(cursor, start):
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {TABLE} '
+        'FOR VALUES FROM (%s) TO (%s)', [start, add_months(start, 1)],
+    )
+
+
+def ensure_partitions(months_ahead=None):
+    # Create this month's partition and the next `months_ahead`, so inserts
+    # never land in the default partition; months the legacy partition
+    # still covers are left to it
+    if not is_partitioned():
+        return 0
+    months_ahead = getattr(settings, 'API_CALL_PARTITION_MONTHS_AHEAD', 3) if months_ahead is None else months_ahead
+    existing = {name for name, _, _ in partitions()}
+    start = month_start(timezone.now())
+    covered = legacy_end() or start
+    created = 0
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(start, offset)
+            if month >= covered and partition_name(month) not in existing:
+                create_partition(cursor, month)
+                created += 1
+    return created
+
+
+def drop_partition(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+    logger.info('Dropped API call partition %s', name)
+
+
+def partition_table(months_ahead=None):
+    """
+    Convert the API call table into one range-partitioned by month on
+    `timestamp`. Existing rows stay in the old table, attached as the
+    partition for everything up to the end of the month of its latest row
+    (at least the current one), and are aged out by the batch path; monthly
+    partitions start after it. The primary key becomes (id, timestamp), as
+    PostgreSQL requires the partition key in it; ids keep coming from one
+    sequence.
+    Takes an exclusive lock on the table, so run it in a quiet window.
+    """
+    statements = [
+        f'ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}',
+        f'ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP IDENTITY IF EXISTS',
+        f'CREATE SEQUENCE {TABLE}_partitioned_id_seq',
+        f"SELECT setval('{TABLE}_partitioned_id_seq', COALESCE((SELECT MAX(id) FROM {LEGACY_TABLE}), 0) + 1, false)",
+        f'CREATE TABLE {TABLE} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING STORAGE) PARTITION BY RANGE (timestamp)',
+        f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_partitioned_id_seq')",
+        f'ALTER SEQUENCE {TABLE}_partitioned_id_seq OWNED BY {TABLE}.id',
+        f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, timestamp)',
+        f'ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED',
+        f'CREATE INDEX {TABLE}_timestamp_id_part_idx ON {TABLE} (timestamp, id)',
+        f'CREATE INDEX {TABLE}_user_id_part_idx ON {TABLE} (user_id)',
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+        # The rename locked the old table, so no row can arrive after this
+        cursor.execute(f'SELECT MAX(timestamp) FROM {LEGACY_TABLE}')
+        latest = max(cursor.fetchone()[0] or timezone.now(), timezone.now())
+        cursor.execute(
+            f'ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY_TABLE} FOR VALUES FROM (MINVALUE) TO (%s)',
+            [add_months(month_start(latest), 1)],
+        )
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+    return ensure_partitions(months_ahead)
@@ -0,0 +1,144 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, RollupWatermark
+
+WATERMARK = 'daily_sales'
+
+
+def get_batch_days():
+    return getattr(settings, 'SALES_ROLLUP_BATCH_DAYS', 31)
+
+
+def get_delay():
+    return timedelta(minutes=getattr(settings, 'SALES_ROLLUP_DELAY_MINUTES', 10))
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_default_timezone())
+
+
+def last_complete_day(now=None):
+    # A day is complete once orders from transactions still open at its end
+    # have had SALES_ROLLUP_DELAY_MINUTES to commit
+    now = (now or timezone.now()) - get_delay()
+    return timezone.localdate(now, timezone.get_default_timezone()) - timedelta(days=1)
+
+
+def aggregate(start, end):
+    # DailySales rows for the days from `start` up to, not including, `end`:
+    # one grouped query per grain, whatever the number of days
+    tz = timezone.get_default_timezone()
+    created = {'created_at__gte': day_start(start), 'created_at__lt': day_start(end)}
+    sellers = (
+        Order.objects.filter(**created)
+        .annotate(date=TruncDate('created_at', tzinfo=tz))
+        .values('date', 'seller_id')
+        .annotate(order_count=Count('id'), revenue=Sum('amount'))
+        .order_by()
+    )
+    # An order holds a product at most once, so a line is one order
+    products = (
+        Order.products.through.objects.filter(**{f'order__{key}': value for key, value in created.items()})
+        .annotate(date=TruncDate('order__created_at', tzinfo=tz), seller_id=F('order__seller_id'))
+        .values('date', 'seller_id', 'product_id')
+        .annotate(order_count=Count('order_id'), revenue=Sum('order__amount'))
+        .order_by()
+    )
+    return [DailySales(**row) for row in sellers] + [DailySales(**row) for row in products]
+
+
+def get_watermark(lock=False):
+    """
+    The rollup's watermark, created on first use at the start of the day of
+    the first order (or of today when there are none yet, as orders are
+    never created in the past). `lock` holds it for the current transaction.
+    """
+    if not RollupWatermark.objects.filter(name=WATERMARK).exists():
+        first = Order.objects.aggregate(first=Min('created_at'))['first'] or timezone.now()
+        RollupWatermark.objects.get_or_create(
+            name=WATERMARK,
+            defaults={'created_before': day_start(timezone.localdate(first, timezone.get_default_timezone()))},
+        )
+    watermark = RollupWatermark.objects.all()
+    if lock:
+        watermark = watermark.select_for_update()
+    return watermark.get(name=WATERMARK)
+
+
+def next_day(watermark):
+    return timezone.localdate(watermark.created_before, timezone.get_default_timezone())
+
+
+def roll_up(until=None):
+    """
+    Add every complete day after the watermark to DailySales, up to `until`
+    (exclusive, and never past the day after the last complete one, as the
+    watermark must not pass days still taking orders). Batches of
+    SALES_ROLLUP_BATCH_DAYS days each commit with the watermark moved past
+    them, so days behind it are never read again and an interrupted run
+    resumes after its last batch.
+    """
+    limit = last_complete_day() + timedelta(days=1)
+    until = min(until, limit) if until else limit
+    result = {'days': 0, 'rows': 0}
+    while True:
+        with transaction.atomic():
+            watermark = get_watermark(lock=True)
+            start = next_day(watermark)
+            if start >= until:
+                break
+            end = min(start + timedelta(days=get_batch_days()), until)
+            rows = aggregate(start, end)
+            DailySales.objects.bulk_create(rows, batch_size=1000)
+            watermark.created_before = day_start(end)
+            watermark.save(update_fields=['created_before'])
+        result['days'] += (end - start).days
+        result['rows'] += len(rows)
+    result['complete_through'] = start - timedelta(days=1)
+    return result
+
+
+def rebuild(since, until=None):
+    # Recompute the days from `since` on, e.g. after orders in them were
+    # changed or deleted; readers see the old rows until it commits
+    with transaction.atomic():
+        watermark = get_watermark(lock=True)
+        if since < next_day(watermark):
+            DailySales.objects.filter(date__gte=since).delete()
+            watermark.created_before = day_start(since)
+            watermark.save(update_fields=['created_before'])
+        return roll_up(until)
+
+
+def complete_through():
+    # Last day the rollups cover, None before the first one has run
+    watermark = RollupWatermark.objects.filter(name=WATERMARK).values_list('created_before', flat=True).first()
+    if watermark is None:
+        return None
+    return timezone.localdate(watermark, timezone.get_default_timezone()) - timedelta(days=1)
+
+
+def seller_revenue(start, end, seller=None):
+    # Orders and revenue per seller per day, for the days from `start` to `end` inclusive
+    rows = DailySales.objects.filter(product__isnull=True, date__gte=start, date__lte=end)
+    if seller is not None:
+        rows = rows.filter(seller_id=seller)
+    return rows.values('date', 'seller_id', 'order_count', 'revenue').order_by('date', 'seller_id')
+
+
+def top_products(start, end, limit, seller=None):
+    # Products in the most orders from `start` to `end` inclusive
+    rows = DailySales.objects.filter(product__isnull=False, date__gte=start, date__lte=end)
+    if seller is not None:
+        rows = rows.filter(seller_id=seller)
+    return (
+        rows.values('product_id', name=F('product__name'))
+        .annotate(order_count=Sum('order_count'), revenue=Sum('revenue'))
+        .order_by('-order_count', 'product_id')[:limit]
+    )
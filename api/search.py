@@ -0,0 +1,106 @@
+import threading
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import filters
+
+from . import cache, replicas
+from .models import Order, Product
+
+BACKEND_DATABASE = 'database'
+BACKEND_MEMORY = 'memory'
+
+# Beyond this many matches an id list is a worse filter than icontains itself
+MAX_MATCHED_IDS = 10000
+
+
+def get_backend():
+    backend = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return BACKEND_DATABASE if connection.vendor == 'postgresql' else BACKEND_MEMORY
+    return backend
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductNameIndex:
+    """
+    In-process trigram inverted index over product names, for databases
+    without a trigram index. A term of three or more characters is looked up
+    by intersecting the posting lists of its trigrams and then confirming the
+    substring; shorter terms scan the names.
+    """
+
+    def __init__(self, rows):
+        self.names = {}
+        self.postings = {}
+        for pk, name in rows:
+            name = name.casefold()
+            self.names[pk] = name
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, set()).add(pk)
+
+    def search(self, term):
+        term = term.casefold()
+        grams = trigrams(term)
+        if not grams:
+            return {pk for pk, name in self.names.items() if term in name}
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*postings)
+        return {pk for pk in candidates if term in self.names[pk]}
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    # Rebuilt whenever the product cache version moves, i.e. after any product
+    # save or delete, or an import. Read from the primary, as a replica may
+    # not have the change yet and the index outlives the request.
+    global _index, _index_version
+    version = cache.get_version(cache.PRODUCTS)
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = ProductNameIndex(Product.objects.using(replicas.PRIMARY).values_list('id', 'name').iterator(chunk_size=5000))
+                _index_version = version
+    return _index
+
+
+def match_product_ids(term):
+    # Ids of products whose name contains `term`: a subquery that can use the
+    # trigram index, or a set from the in-process index
+    if get_backend() == BACKEND_MEMORY:
+        ids = get_index().search(term)
+        if len(ids) <= MAX_MATCHED_IDS:
+            return ids
+    return Product.objects.filter(name__icontains=term).values('id')
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        for term in self.get_search_terms(request):
+            if get_backend() == BACKEND_MEMORY:
+                queryset = queryset.filter(pk__in=match_product_ids(term))
+            else:
+                queryset = queryset.filter(name__icontains=term)
+        return queryset
+
+
+class OrderProductSearchFilter(filters.SearchFilter):
+    """
+    Search orders by product name by resolving the matching product ids first
+    and then the orders holding them, rather than joining the M2M table into
+    the main query and de-duplicating.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        through = Order.products.through
+        for term in self.get_search_terms(request):
+            order_ids = through.objects.filter(product_id__in=match_product_ids(term)).values('order_id')
+            queryset = queryset.filter(pk__in=order_ids)
+        return queryset
@@ -1,5 +1,12 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.query import QuerySet
 from rest_framework import serializers
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
 from django.contrib.auth.models import User
+from . import audit, prices, summaries
 from .models import Customer, Seller, Product, Order, PlatformApiCall
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,33 +32,349 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'name', 'amount']
+        # Uniqueness (case-insensitive) is left to the database constraint,
+        # which also holds under concurrent writes
+        extra_kwargs = {'name': {'validators': []}}
 
-    def validate_name(self, value):
-        if Product.objects.filter(name__iexact=value).exists():
-            raise serializers.ValidationError("Product with this name already exists.")
-        return value
+    def create(self, validated_data):
+        with self.name_taken():
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with self.name_taken():
+            return super().update(instance, validated_data)
+
+    @contextmanager
+    def name_taken(self):
+        # Name is the only product column the constraint can reject once
+        # the fields are valid
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError:
+            raise serializers.ValidationError({'name': ['Product with this name already exists.']})
+
+def resolve_amount(amount, product_ids, product_prices, mode=None):
+    """
+    The amount to store for an order holding `product_ids`, per `mode` or
+    ORDER_AMOUNT_MODE: 'compute' ignores the client's amount, 'verify' requires
+    it to match the product total and 'client' stores it unchecked.
+    """
+    mode = mode or prices.get_mode()
+    if mode == prices.MODE_CLIENT:
+        if amount is None:
+            raise serializers.ValidationError({'amount': ['This field is required.']})
+        return amount
+    total = prices.order_amount(product_ids, product_prices)
+    if total > prices.MAX_AMOUNT:
+        raise serializers.ValidationError({'amount': [f'The product total {total} is too large for an order.']})
+    if mode == prices.MODE_VERIFY and amount != total:
+        raise serializers.ValidationError({'amount': [f'Amount {amount} does not match the product total {total}.']})
+    return total
+
+def missing_product_errors(product_ids, product_prices):
+    message = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+    return [message.format(pk_value=pk) for pk in product_ids if pk not in product_prices]
 
 class OrderSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     seller = SellerSerializer(read_only=True)
     products = ProductSerializer(many=True, read_only=True)
+    # The users come along for the nested customer and seller in the response
     customer_id = serializers.PrimaryKeyRelatedField(
-        queryset=Customer.objects.all(), source='customer', write_only=True
+        queryset=Customer.objects.select_related('user'), source='customer', write_only=True
     )
     seller_id = serializers.PrimaryKeyRelatedField(
-        queryset=Seller.objects.all(), source='seller', write_only=True
-    )
-    product_ids = serializers.PrimaryKeyRelatedField(
-        queryset=Product.objects.all(), source='products', many=True, write_only=True
+        queryset=Seller.objects.select_related('user'), source='seller', write_only=True
     )
+    # Checked against the price cache, which also prices the order
+    product_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
 
     class Meta:
         model = Order
         fields = ['id', 'customer', 'seller', 'products', 'customer_id', 'seller_id', 'product_ids', 'amount', 'created_at']
 
+    def validate_product_ids(self, value):
+        value = list(dict.fromkeys(value))
+        self.product_prices = prices.price_cache.get_many(value)
+        errors = missing_product_errors(value, self.product_prices)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
+    def validate(self, attrs):
+        product_ids = attrs.get('product_ids')
+        if product_ids is None:
+            if self.instance is None:
+                raise serializers.ValidationError({'product_ids': ['This field is required.']})
+            if 'amount' not in attrs or prices.get_mode() == prices.MODE_CLIENT:
+                return attrs
+            # A partial update of the amount alone is checked against the current products
+            product_ids = list(self.instance.products.values_list('id', flat=True))
+            self.product_prices = prices.price_cache.get_many(product_ids)
+        mode = None
+        if self.partial and 'amount' not in attrs:
+            # A partial update of the products alone keeps a client-supplied
+            # amount; otherwise the order is repriced for its new products
+            if prices.get_mode() == prices.MODE_CLIENT:
+                return attrs
+            mode = prices.MODE_COMPUTE
+        attrs['amount'] = resolve_amount(attrs.get('amount'), product_ids, self.product_prices, mode)
+        return attrs
+
+    def create(self, validated_data):
+        product_ids = validated_data.pop('product_ids')
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(**validated_data)
+                # A new order has no links to read or touch, so they are
+                # inserted without add()'s m2m_changed round trips
+                Order.products.through.objects.bulk_create([
+                    Order.products.through(order_id=order.id, product_id=product_id) for product_id in set(product_ids)
+                ])
+        except IntegrityError:
+            # A product was deleted after the price cache saw it
+            raise serializers.ValidationError({'product_ids': ['One or more products no longer exist.']})
+        return order
+
+    def update(self, instance, validated_data):
+        product_ids = validated_data.pop('product_ids', None)
+        try:
+            with transaction.atomic():
+                instance = super().update(instance, validated_data)
+                if product_ids is not None:
+                    instance.products.set(product_ids)
+        except IntegrityError:
+            raise serializers.ValidationError({'product_ids': ['One or more products no longer exist.']})
+        return instance
+
+class OrderBulkItemSerializer(serializers.Serializer):
+    # Shape-only checks; references are validated for the whole batch at once
+    customer_id = serializers.IntegerField()
+    seller_id = serializers.IntegerField()
+    product_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+class OrderBulkCreateSerializer(serializers.Serializer):
+    """
+    Validates and prices a batch of orders with one IN query per referenced
+    model (none for products when the price cache is warm) and writes them
+    with two bulk inserts (orders, then their product links) in a single
+    transaction. Errors are keyed by item index, as DRF reports them for
+    nested lists, and nothing is written unless every item is valid.
+    """
+    orders = OrderBulkItemSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, items):
+        max_items = getattr(settings, 'ORDER_BULK_MAX_ITEMS', 5000)
+        if len(items) > max_items:
+            raise serializers.ValidationError(f'Ensure this field has no more than {max_items} orders.')
+
+        references = {
+            'customer_id': (Customer, {item['customer_id'] for item in items}),
+            'seller_id': (Seller, {item['seller_id'] for item in items}),
+        }
+        existing = {
+            field: set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            for field, (model, ids) in references.items()
+        }
+        product_prices = prices.price_cache.get_many(pk for item in items for pk in item['product_ids'])
+
+        message = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+        errors = {}
+        for index, item in enumerate(items):
+            item_errors = {}
+            for field in ('customer_id', 'seller_id'):
+                if item[field] not in existing[field]:
+                    item_errors[field] = [message.format(pk_value=item[field])]
+            missing = missing_product_errors(item['product_ids'], product_prices)
+            if missing:
+                item_errors['product_ids'] = missing
+            else:
+                try:
+                    item['amount'] = resolve_amount(item.get('amount'), item['product_ids'], product_prices)
+                except serializers.ValidationError as exc:
+                    item_errors.update(exc.detail)
+            if item_errors:
+                errors[index] = item_errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        items = validated_data['orders']
+        through = Order.products.through
+        try:
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    Order(customer_id=item['customer_id'], seller_id=item['seller_id'], amount=item['amount'])
+                    for item in items
+                ])
+                through.objects.bulk_create([
+                    through(order_id=order.id, product_id=product_id)
+                    for order, item in zip(orders, items)
+                    for product_id in dict.fromkeys(item['product_ids'])
+                ])
+                summaries.orders_bulk_created(orders)
+        except IntegrityError:
+            # A product was deleted after the price cache saw it
+            raise serializers.ValidationError({'orders': ['One or more products no longer exist.']})
+        return orders
+
+class OrderReadSerializer:
+    """
+    Read-only stand-in for OrderSerializer on list and retrieve that renders
+    the same JSON without DRF's per-field machinery. A queryset is read with
+    a single joined `.values()` query; model instances (a page or a retrieved
+    object) should come with `customer__user` and `seller__user` selected.
+    Products are fetched for all orders in one query on the through table.
+    """
+    amount_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+    created_at_field = serializers.DateTimeField()
+    party_fields = ['id', 'name', 'mobile', 'user_id', 'user__username', 'user__email']
+    products_batch_size = 2000
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @property
+    def data(self):
+        if not self.many:
+            return ReturnDict(self.to_representation([self.instance])[0], serializer=self)
+        return ReturnList(self.to_representation(self.instance), serializer=self)
+
+    async def adata(self):
+        # `data` for async views: the same queries, run with the async ORM
+        orders = self.instance if self.many else [self.instance]
+        if isinstance(orders, QuerySet):
+            rows = [row async for row in self.values(orders)]
+        else:
+            rows = [self.order_row(order) for order in orders]
+        products = {}
+        for links in self.product_links([row['id'] for row in rows]):
+            async for link in links:
+                self.add_product(products, link)
+        data = self.represent(rows, products)
+        return data if self.many else data[0]
+
+    def to_representation(self, orders):
+        if isinstance(orders, QuerySet):
+            rows = list(self.values(orders))
+        else:
+            rows = [self.order_row(order) for order in orders]
+        return self.represent(rows, self.products_by_order([row['id'] for row in rows]))
+
+    def values(self, orders):
+        return orders.prefetch_related(None).values(
+            'id', 'amount', 'created_at',
+            *[f'customer__{field}' for field in self.party_fields],
+            *[f'seller__{field}' for field in self.party_fields],
+        )
+
+    def represent(self, rows, products):
+        amount = self.amount_field.to_representation
+        created_at = self.created_at_field.to_representation
+        return [
+            {
+                'id': row['id'],
+                'customer': self.party(row, 'customer'),
+                'seller': self.party(row, 'seller'),
+                'products': products.get(row['id'], []),
+                'amount': amount(row['amount']),
+                'created_at': created_at(row['created_at']),
+            }
+            for row in rows
+        ]
+
+    def order_row(self, order):
+        row = {'id': order.id, 'amount': order.amount, 'created_at': order.created_at}
+        for prefix, party in (('customer', order.customer), ('seller', order.seller)):
+            row.update({
+                f'{prefix}__id': party.id,
+                f'{prefix}__name': party.name,
+                f'{prefix}__mobile': party.mobile,
+                f'{prefix}__user_id': party.user.id,
+                f'{prefix}__user__username': party.user.username,
+                f'{prefix}__user__email': party.user.email,
+            })
+        return row
+
+    def party(self, row, prefix):
+        return {
+            'id': row[f'{prefix}__id'],
+            'name': row[f'{prefix}__name'],
+            'mobile': row[f'{prefix}__mobile'],
+            'user': {
+                'id': row[f'{prefix}__user_id'],
+                'username': row[f'{prefix}__user__username'],
+                'email': row[f'{prefix}__user__email'],
+            },
+        }
+
+    def products_by_order(self, order_ids):
+        products = {}
+        for links in self.product_links(order_ids):
+            for link in links:
+                self.add_product(products, link)
+        return products
+
+    def product_links(self, order_ids):
+        through = Order.products.through
+        for start in range(0, len(order_ids), self.products_batch_size):
+            yield (
+                through.objects.filter(order_id__in=order_ids[start:start + self.products_batch_size])
+                .order_by('id')
+                .values_list('order_id', 'product_id', 'product__name', 'product__amount')
+            )
+
+    def add_product(self, products, link):
+        order_id, product_id, name, amount = link
+        products.setdefault(order_id, []).append(
+            {'id': product_id, 'name': name, 'amount': self.amount_field.to_representation(amount)}
+        )
+
 class PlatformApiCallSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = PlatformApiCall
-        fields = ['id', 'user', 'requested_url', 'requested_data', 'response_data', 'timestamp']
+        fields = [
+            'id', 'user', 'requested_url', 'method', 'status_code', 'duration_ms',
+            'requested_data', 'response_data', 'timestamp',
+        ]
+
+    def to_representation(self, instance):
+        # Compressed bodies are shown as they were logged
+        data = super().to_representation(instance)
+        for field in ('requested_data', 'response_data'):
+            data[field] = audit.decode_payload(data[field], instance.payload_encoding)
+        return data
+
+class SalesRangeSerializer(serializers.Serializer):
+    # Query parameters of the sales analytics endpoints; both days are included
+    start = serializers.DateField()
+    end = serializers.DateField()
+    seller = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'end': ['Must not be before start.']})
+        max_days = getattr(settings, 'SALES_ANALYTICS_MAX_DAYS', 366)
+        if (data['end'] - data['start']).days >= max_days:
+            raise serializers.ValidationError({'end': [f'Ranges are limited to {max_days} days.']})
+        return data
+
+class SellerRevenueSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    seller = serializers.IntegerField(source='seller_id')
+    order_count = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class TopProductSerializer(serializers.Serializer):
+    product = serializers.IntegerField(source='product_id')
+    name = serializers.CharField()
+    order_count = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
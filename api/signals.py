@@ -0,0 +1,122 @@
+from celery.signals import task_prerun
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from . import authentication, cache, pooling, summaries
+from .models import Customer, Order, Product, Seller
+
+# Saves that can change what an order contributes to its summaries
+SUMMARY_FIELDS = {'customer', 'customer_id', 'seller', 'seller_id', 'amount'}
+
+@receiver(pre_save, sender=Order)
+def remember_order_owners(sender, instance, raw=False, update_fields=None, **kwargs):
+    # An update may move the order to another customer or seller or change
+    # its amount; the summaries hold the stored values until post_save
+    instance._previous = None
+    if raw or instance._state.adding or (update_fields is not None and not SUMMARY_FIELDS & set(update_fields)):
+        return
+    instance._previous = Order.objects.filter(pk=instance.pk).values('customer_id', 'seller_id', 'amount').first()
+
+@receiver(post_save, sender=Order)
+def update_order_summaries(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        summaries.order_created(instance)
+    elif instance._previous is not None:
+        summaries.order_updated(instance, instance._previous)
+
+@receiver(pre_delete, sender=Order)
+def remember_top_order(sender, instance, **kwargs):
+    # The TopOrder row is cascade-deleted before post_delete runs
+    instance._was_top_order = summaries.top_order_affected(instance)
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_summaries(sender, instance, **kwargs):
+    summaries.order_deleted(instance, getattr(instance, '_was_top_order', True))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_caches(sender, raw=False, **kwargs):
+    # Orphans cached product responses, the in-process search index and the
+    # price cache; after commit, so nothing re-caches the old row meanwhile
+    if raw:
+        return
+    transaction.on_commit(lambda: cache.bump_version(cache.PRODUCTS))
+
+@receiver(m2m_changed, sender=Order.products.through)
+def touch_order_products(sender, instance, action, reverse, pk_set, **kwargs):
+    # Adding or removing products doesn't save the order; move its
+    # updated_at so its ETag changes all the same
+    if action == 'pre_clear' and reverse:
+        instance._cleared_order_ids = list(instance.orders.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        order_ids = [instance.pk]
+    elif action == 'post_clear':
+        order_ids = getattr(instance, '_cleared_order_ids', [])
+    else:
+        order_ids = pk_set or []
+    if order_ids:
+        Order.objects.filter(pk__in=order_ids).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def invalidate_party_versions(sender, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(lambda: cache.bump_version(cache.PARTIES))
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    authentication.invalidate([instance.key])
+
+# User fields that cached tokens' copies of their user must not get wrong
+AUTH_FIELDS = ('is_active', 'password', 'is_staff', 'is_superuser')
+
+def auth_state(user):
+    # From __dict__, so deferred fields are not loaded
+    return [user.__dict__.get(field) for field in AUTH_FIELDS]
+
+@receiver(post_init, sender=User)
+def remember_auth_state(sender, instance, **kwargs):
+    instance._auth_state = auth_state(instance)
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Cached tokens carry a copy of the user, read again after a change that
+    # can lock them out or change their permissions; logins, which only save
+    # last_login, keep them
+    if raw:
+        return
+    if update_fields is None:
+        changed = auth_state(instance) != instance._auth_state
+    else:
+        changed = bool(set(AUTH_FIELDS) & set(update_fields))
+    instance._auth_state = auth_state(instance)
+    if changed and not created:
+        authentication.invalidate(Token.objects.filter(user=instance).values_list('key', flat=True))
+    # Orders show their customer's and seller's username and email
+    if update_fields is None or {'username', 'email'} & set(update_fields):
+        transaction.on_commit(lambda: cache.bump_version(cache.PARTIES))
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    pooling.counters.opened(connection.alias)
+
+@receiver(request_started)
+def count_request(sender, **kwargs):
+    pooling.counters.served('requests')
+
+@task_prerun.connect
+def count_task(**kwargs):
+    pooling.counters.served('tasks')
@@ -0,0 +1,272 @@
+import zlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, Max, Subquery, Sum, When
+from django.db.models.functions import Greatest
+from django.utils.dateparse import parse_datetime
+
+from .models import Order, CustomerOrderSummary, SellerOrderSummary, TopOrder
+
+MODE_SYNC = 'sync'
+MODE_CELERY = 'celery'
+
+# Summary models by the name deltas use for them, with their owner key
+SUMMARIES = {
+    'customer': (CustomerOrderSummary, 'customer_id'),
+    'seller': (SellerOrderSummary, 'seller_id'),
+}
+
+TOP_ORDERS_LOCK = zlib.crc32(b'api.top_orders')
+REBUILD_TOP = 'rebuild'
+
+# Delta fields holding datetimes, sent to Celery as ISO strings
+TIME_FIELDS = ('added_at', 'removed_at')
+
+
+def get_mode():
+    return getattr(settings, 'ORDER_SUMMARY_MODE', MODE_SYNC)
+
+
+def get_top_n():
+    return getattr(settings, 'ORDER_SUMMARY_TOP_N', 100)
+
+
+def change(model, key, owner_id, count, revenue, added_at=None, removed_at=None):
+    """
+    O(1) delta to one summary: `count` more orders (fewer when negative) and
+    `revenue` more. `added_at` is the creation time of the latest order
+    joining it, `removed_at` that of an order leaving it, which only costs
+    a lookup of the owner's latest order when it was the last one. A summary
+    left without orders is deleted.
+    """
+    lookup = {key: owner_id}
+    updates = {'order_count': F('order_count') + count, 'revenue': F('revenue') + revenue}
+    if added_at is not None:
+        updates['last_order_at'] = Greatest(F('last_order_at'), added_at)
+    elif removed_at is not None:
+        latest = Order.objects.filter(**lookup).order_by('-created_at').values('created_at')[:1]
+        updates['last_order_at'] = Case(
+            When(last_order_at__lte=removed_at, then=Subquery(latest)), default=F('last_order_at'),
+        )
+    updated = model.objects.filter(**lookup).update(**updates)
+    if count < 0:
+        model.objects.filter(order_count__lte=0, **lookup).delete()
+    if updated or count <= 0:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(order_count=count, revenue=revenue, last_order_at=added_at, **lookup)
+    except IntegrityError:
+        # Someone else created the row first; apply the delta to theirs
+        change(model, key, owner_id, count, revenue, added_at)
+
+
+def added(order):
+    # Deltas for a new order
+    return [
+        {'summary': name, 'owner': getattr(order, key), 'count': 1, 'revenue': order.amount, 'added_at': order.created_at}
+        for name, (model, key) in SUMMARIES.items()
+    ]
+
+
+def removed(order):
+    # Deltas for a deleted order
+    return [
+        {'summary': name, 'owner': getattr(order, key), 'count': -1, 'revenue': -order.amount, 'removed_at': order.created_at}
+        for name, (model, key) in SUMMARIES.items()
+    ]
+
+
+def updated(order, previous):
+    # Deltas for an order saved over `previous` {customer_id, seller_id, amount}
+    deltas = []
+    for name, (model, key) in SUMMARIES.items():
+        owner, amount = previous[key], previous['amount']
+        if owner == getattr(order, key):
+            if amount != order.amount:
+                deltas.append({'summary': name, 'owner': owner, 'count': 0, 'revenue': order.amount - amount})
+        else:
+            deltas.append({'summary': name, 'owner': owner, 'count': -1, 'revenue': -amount, 'removed_at': order.created_at})
+            deltas.append({
+                'summary': name, 'owner': getattr(order, key), 'count': 1, 'revenue': order.amount,
+                'added_at': order.created_at,
+            })
+    return deltas
+
+
+def bulk_added(orders):
+    # One delta per owner for a batch of new orders
+    deltas = {}
+    for order in orders:
+        for delta in added(order):
+            merged = deltas.setdefault((delta['summary'], delta['owner']), {**delta, 'count': 0, 'revenue': 0})
+            merged['count'] += 1
+            merged['revenue'] += delta['revenue']
+            merged['added_at'] = max(merged['added_at'], delta['added_at'])
+    return list(deltas.values())
+
+
+def apply(deltas):
+    for delta in deltas:
+        model, key = SUMMARIES[delta['summary']]
+        change(
+            model, key, delta['owner'], delta['count'], delta['revenue'],
+            added_at=delta.get('added_at'), removed_at=delta.get('removed_at'),
+        )
+
+
+def encode(deltas):
+    # JSON-safe deltas for the Celery task
+    return [
+        {**delta, 'revenue': str(delta['revenue']), **{field: delta[field].isoformat() for field in TIME_FIELDS if field in delta}}
+        for delta in deltas
+    ]
+
+
+def decode(deltas):
+    return [
+        {**delta, 'revenue': Decimal(delta['revenue']), **{field: parse_datetime(delta[field]) for field in TIME_FIELDS if field in delta}}
+        for delta in deltas
+    ]
+
+
+def refresh(model, key, ids):
+    # Recompute the summaries of `ids` from their orders
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return
+    field = key.removesuffix('_id')
+    totals = {
+        row[key]: row
+        for row in Order.objects.filter(**{f'{key}__in': ids}).values(key).annotate(
+            order_count=Count('id'), revenue=Sum('amount'), last_order_at=Max('created_at'),
+        ).order_by()
+    }
+    model.objects.filter(**{f'{field}__in': ids - set(totals)}).delete()
+    if totals:
+        model.objects.bulk_create(
+            [model(**row) for row in totals.values()],
+            update_conflicts=True,
+            unique_fields=[field],
+            update_fields=['order_count', 'revenue', 'last_order_at'],
+        )
+
+
+def lock_top_orders():
+    # Serializes changes to the top-N list until the transaction ends. Only
+    # needed on PostgreSQL; SQLite already allows one writer at a time.
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [TOP_ORDERS_LOCK])
+
+
+def rebuild_top_orders():
+    with transaction.atomic(savepoint=False):
+        lock_top_orders()
+        top = list(Order.objects.order_by('-amount', '-id').values_list('id', 'amount')[:get_top_n()])
+        TopOrder.objects.all().delete()
+        TopOrder.objects.bulk_create([TopOrder(order_id=pk, amount=amount) for pk, amount in top])
+
+
+def offer_top_order(order_id, amount):
+    # Admit a new order into the top-N list if it beats the current minimum
+    amount = Decimal(str(amount))
+    top_n = get_top_n()
+    # The lock lasts until the request's transaction, when there is one,
+    # commits; no savepoint is needed inside it
+    with transaction.atomic(savepoint=False):
+        lock_top_orders()
+        current = TopOrder.objects.order_by('amount', 'order_id').values_list('order_id', 'amount')
+        count = current.count()
+        if count >= top_n:
+            lowest_id, lowest_amount = current.first()
+            if (amount, order_id) <= (lowest_amount, lowest_id):
+                return
+            TopOrder.objects.filter(order_id=lowest_id).delete()
+        # Only new orders are offered, so there is no row to update
+        TopOrder.objects.create(order_id=order_id, amount=amount)
+
+
+def apply_changes(deltas, top=None):
+    apply(deltas)
+    if top == REBUILD_TOP:
+        rebuild_top_orders()
+    elif top is not None:
+        offer_top_order(*top)
+
+
+def schedule(deltas, top=None):
+    """
+    Apply summary `deltas` and a `top` list change, either an [order id,
+    amount] to offer or REBUILD_TOP: now, or after commit in a Celery task
+    in celery mode.
+    """
+    if not deltas and top is None:
+        return
+    if get_mode() == MODE_CELERY:
+        from .tasks import apply_order_summary_changes
+        payload = encode(deltas)
+        transaction.on_commit(lambda: apply_order_summary_changes.delay(payload, top))
+    else:
+        apply_changes(deltas, top)
+
+
+def order_created(order):
+    schedule(added(order), [order.id, str(order.amount)])
+
+
+def order_updated(order, previous):
+    amount_changed = previous['amount'] != order.amount
+    schedule(updated(order, previous), REBUILD_TOP if amount_changed and top_order_affected(order) else None)
+
+
+def order_deleted(order, was_top_order=True):
+    schedule(removed(order), REBUILD_TOP if was_top_order else None)
+
+
+def orders_changed(customer_ids, seller_ids, top_changed=True):
+    # Full recompute, for refresh_order_summaries tasks queued before the
+    # switch to deltas
+    refresh(CustomerOrderSummary, 'customer_id', customer_ids)
+    refresh(SellerOrderSummary, 'seller_id', seller_ids)
+    if top_changed:
+        rebuild_top_orders()
+
+
+def orders_bulk_created(orders):
+    # bulk_create skips the Order signals, so batches report here instead
+    lowest = TopOrder.objects.order_by('amount').values_list('amount', flat=True).first()
+    top_changed = lowest is None or TopOrder.objects.count() < get_top_n() or any(order.amount > lowest for order in orders)
+    schedule(bulk_added(orders), REBUILD_TOP if top_changed else None)
+
+
+def top_order_affected(order):
+    # An update or delete only moves the top-N list if it touches a member of
+    # it, or raises an amount above the current minimum.
+    if TopOrder.objects.filter(order_id=order.id).exists():
+        return True
+    lowest = TopOrder.objects.order_by('amount').values_list('amount', flat=True).first()
+    return lowest is None or order.amount > lowest
+
+
+def rebuild():
+    with transaction.atomic():
+        CustomerOrderSummary.objects.all().delete()
+        SellerOrderSummary.objects.all().delete()
+        for model, key in ((CustomerOrderSummary, 'customer_id'), (SellerOrderSummary, 'seller_id')):
+            rows = Order.objects.values(key).annotate(
+                order_count=Count('id'), revenue=Sum('amount'), last_order_at=Max('created_at'),
+            ).order_by()
+            model.objects.bulk_create([model(**row) for row in rows], batch_size=1000)
+        rebuild_top_orders()
+    return {
+        'customers': CustomerOrderSummary.objects.count(),
+        'sellers': SellerOrderSummary.objects.count(),
+        'top_orders': TopOrder.objects.count(),
+    }
+
+
+def top_order_ids():
+    return TopOrder.objects.values('order_id')
@@ -1,16 +1,94 @@
-from celery import shared_task
-import pandas as pd
-from .models import Product
+import logging
+from celery import shared_task, chain, chord
+from django.conf import settings
+from django.db import OperationalError
+from django.utils.dateparse import parse_datetime
+from . import importer, retention, rollups, summaries
+from .models import PlatformApiCall, ProductImportChunk
+
+logger = logging.getLogger(__name__)
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def import_products(file_path, chunk_size=importer.DEFAULT_CHUNK_SIZE, incremental=False):
+    if incremental:
+        # Safe to retry: the run manifest resumes after the last committed chunk
+        stats = importer.import_products_incremental(file_path, chunk_size=chunk_size)
+    else:
+        stats = importer.import_products(file_path, chunk_size=chunk_size)
+    logger.info('Imported products from %s: %s', file_path, stats)
+    return stats.as_dict()
+
+@shared_task
+def import_products_parallel(file_path=None, chunk_size=None, concurrency=None, run_id=None):
+    """
+    Split `file_path` into row ranges and import them with one task per range.
+
+    At most `concurrency` chunk tasks are dispatched at a time, each wave as a
+    chord whose callback sums up the run so far. Passing the `run_id` of an
+    earlier run re-dispatches only its chunks that have not committed yet.
+    """
+    chunk_size = chunk_size or getattr(settings, 'PRODUCT_IMPORT_CHUNK_SIZE', importer.DEFAULT_CHUNK_SIZE)
+    concurrency = concurrency or getattr(settings, 'PRODUCT_IMPORT_CONCURRENCY', None)
+    if run_id is None:
+        run_id = importer.plan_parallel_import(file_path, chunk_size).id
+
+    chunk_ids = list(
+        ProductImportChunk.objects.filter(run_id=run_id)
+        .exclude(status=ProductImportChunk.SUCCEEDED)
+        .order_by('index').values_list('id', flat=True)
+    )
+    if not chunk_ids:
+        return finish_product_import(run_id)
+
+    wave_size = concurrency or len(chunk_ids)
+    waves = [
+        chord([import_product_chunk.si(chunk_id) for chunk_id in chunk_ids[start:start + wave_size]],
+              finish_product_import.si(run_id))
+        for start in range(0, len(chunk_ids), wave_size)
+    ]
+    chain(*waves).apply_async()
+    return {'run_id': run_id, 'chunks': len(chunk_ids), 'waves': len(waves)}
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def import_product_chunk(chunk_id):
+    return importer.import_chunk(chunk_id)
+
+@shared_task
+def finish_product_import(run_id):
+    summary = importer.finish_parallel_import(run_id)
+    logger.info('Parallel product import run %s: %s', run_id, summary)
+    return summary
 
 @shared_task
-def import_products(file_path):
-    # Read Excel file
-    data = pd.read_excel(file_path)
-    
-    # Iterate through rows and create Product objects
-    for _, row in data.iterrows():
-        Product.objects.update_or_create(
-            name=row['product_name'],
-            defaults={'amount': row['amount']},
-        )
-    return f"Imported {len(data)} products successfully."
+def write_api_calls(records):
+    # Sink for the audit log buffer in celery mode
+    PlatformApiCall.objects.bulk_create([
+        PlatformApiCall(**{**record, 'timestamp': parse_datetime(record['timestamp'])})
+        for record in records
+    ])
+    return len(records)
+
+
+@shared_task
+def apply_order_summary_changes(deltas, top=None):
+    summaries.apply_changes(summaries.decode(deltas), top)
+
+@shared_task
+def refresh_order_summaries(customer_ids, seller_ids, top_changed=True):
+    # Sent before summaries moved to deltas; kept for messages still queued
+    summaries.orders_changed(customer_ids, seller_ids, top_changed)
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def apply_api_call_retention():
+    # Safe to retry: every tier works in committed batches from the oldest row
+    result = retention.apply()
+    logger.info('API call retention: %s', result)
+    return result
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def roll_up_sales():
+    # Safe to retry: every batch of days commits together with the watermark
+    result = rollups.roll_up()
+    logger.info('Sales rollups: %s', result)
+    return {**result, 'complete_through': result['complete_through'].isoformat()}
@@ -1,6 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, ProductViewSet, PlatformApiCallViewSet
+from .views import (
+    OrderViewSet, ProductViewSet, PlatformApiCallViewSet, SalesAnalyticsViewSet, RequestMetricsView, ConnectionMetricsView,
+)
+from .async_views import AsyncOrderView, AsyncProductView
 
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -8,9 +11,17 @@ router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'products', ProductViewSet, basename='product'),
 router.register(r'api-calls', PlatformApiCallViewSet)
+router.register(r'analytics/sales', SalesAnalyticsViewSet, basename='sales-analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/requests/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('metrics/connections/', ConnectionMetricsView.as_view(), name='connection-metrics'),
+    # Async reads, for ASGI deployments
+    path('async/orders/', AsyncOrderView.as_view('list'), name='async-order-list'),
+    path('async/orders/<int:pk>/', AsyncOrderView.as_view('retrieve'), name='async-order-detail'),
+    path('async/products/', AsyncProductView.as_view('list'), name='async-product-list'),
+    path('async/products/<int:pk>/', AsyncProductView.as_view('retrieve'), name='async-product-detail'),
 ]
 
 urlpatterns += [
@@ -1,60 +1,131 @@
 from rest_framework import viewsets, filters, status
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Order, Product, PlatformApiCall
-from .serializers import OrderSerializer, ProductSerializer, PlatformApiCallSerializer
+from .models import Order, Product, PlatformApiCall, TopOrder
+from .serializers import (
+    OrderSerializer, OrderBulkCreateSerializer, OrderReadSerializer, ProductSerializer, PlatformApiCallSerializer,
+    SalesRangeSerializer, SellerRevenueSerializer, TopProductSerializer,
+)
 from .permissions import IsOwnerOrAdmin
-from .mixins import PlatformApiCallMixin
+from .search import ProductSearchFilter, OrderProductSearchFilter
+from .pagination import OrderCursorPagination, PlatformApiCallCursorPagination
+from .mixins import RequestTimingMixin, ReplicaReadMixin, PlatformApiCallMixin, CachedReadMixin, ConditionalGetMixin, StreamingExportMixin
+from . import cache, exports, facets, instrumentation, pooling, rollups, summaries
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
-class OrderViewSet(PlatformApiCallMixin, viewsets.ModelViewSet):
-    queryset = Order.objects.all().select_related('customer', 'seller').prefetch_related('products')
+class OrderViewSet(RequestTimingMixin, ReplicaReadMixin, PlatformApiCallMixin, ConditionalGetMixin, StreamingExportMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    read_actions = ('list', 'retrieve')
     permission_classes = [IsAuthenticated, IsOwnerOrAdmin]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = OrderCursorPagination
+    filter_backends = [DjangoFilterBackend, OrderProductSearchFilter, filters.OrderingFilter]
     
     filterset_fields = ['customer', 'seller', 'amount', 'products']
     search_fields = ['products__name']
     ordering_fields = ['amount', 'created_at']
     ordering = ['created_at']
+    # Unpaginated list pages can be huge; their head is enough for the log
+    api_call_log_policy = {'max_payload': 8192}
+    # Orders show their products, customer and seller
+    etag_versions = (cache.PRODUCTS, cache.PARTIES)
+    export_fields = ['id', 'customer_id', 'seller_id', 'amount', 'created_at', 'updated_at']
+    export_columns = export_fields + ['product_ids']
+    export_filename = 'orders'
 
     def get_queryset(self):
         user = self.request.user
+        queryset = self.queryset.select_related('customer__user', 'seller__user')
+        if self.action not in self.read_actions:
+            queryset = queryset.prefetch_related('products')
         if user.is_staff:
-            return self.queryset.all().select_related('customer', 'seller').prefetch_related('products')
-        elif hasattr(user, 'customer'):
-            return self.queryset.filter(customer__user=user).select_related('customer', 'seller').prefetch_related('products')
-        return self.queryset.none()
+            return queryset.all()
+        elif hasattr(user, 'customer_profile'):
+            return queryset.filter(customer__user=user)
+        return queryset.none()
+
+    def get_serializer(self, *args, **kwargs):
+        # List and retrieve render through the lean read path, which loads
+        # products itself, so their querysets skip the products prefetch.
+        if self.action in self.read_actions:
+            return OrderReadSerializer(*args, **kwargs)
+        return super().get_serializer(*args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        # Apply custom sorting like top 5
-        top = request.query_params.get('top', None)
-        queryset = self.filter_queryset(self.get_queryset())
+        # ?facets=true adds counts per seller, customer, product and amount
+        # bucket over the filtered orders; an unpaginated list then moves
+        # under `results`
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets') in ('1', 'true') and response.status_code == status.HTTP_200_OK:
+            data = response.data if isinstance(response.data, dict) else {'results': response.data}
+            response.data = {**data, 'facets': self.get_facets()}
+        return response
+
+    def get_facets(self):
+        # Facets follow get_queryset's scoping: admins share one cache entry,
+        # everyone else gets their own
+        user = self.request.user
+        scope = 'staff' if user.is_staff else f'user:{user.pk}'
+        return facets.get_facets(self.facet_queryset, scope, list(self.request.query_params.lists()))
 
-        if top:
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # Facets count the whole filtered set, not just the top 5 or one page
+        self.facet_queryset = queryset
+        # Apply custom sorting like top 5
+        if self.action == 'list' and self.request.query_params.get('top', None):
+            if self.uses_top_orders():
+                queryset = queryset.filter(pk__in=summaries.top_order_ids())
             queryset = queryset.order_by('-amount')[:5]
+        return queryset
 
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        # Accepts a list of orders, or {"orders": [...]}
+        data = {'orders': request.data} if isinstance(request.data, list) else request.data
+        serializer = OrderBulkCreateSerializer(data=data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.save()
+        return Response({'created': len(orders), 'ids': [order.id for order in orders]}, status=status.HTTP_201_CREATED)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    def export_rows(self, queryset):
+        return exports.iter_rows(queryset, self.export_fields, extra=exports.add_product_ids)
 
-class ProductViewSet(PlatformApiCallMixin, viewsets.ModelViewSet):
+    def uses_top_orders(self):
+        # The precomputed top orders only cover the unfiltered, unscoped set
+        params = set(self.request.query_params) - {'top', 'ordering', 'format'}
+        return self.request.user.is_staff and not params and TopOrder.objects.count() >= 5
+
+class ProductViewSet(RequestTimingMixin, ReplicaReadMixin, PlatformApiCallMixin, ConditionalGetMixin, CachedReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [ProductSearchFilter, filters.OrderingFilter]
     search_fields = ['name']
     ordering_fields = ['amount', 'name']
     ordering = ['name']
+    cache_prefix = cache.PRODUCTS
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAuthenticated, IsAdminUser])
+    def cache_stats(self, request):
+        return Response(cache.stats(self.cache_prefix))
 
-class PlatformApiCallViewSet(viewsets.ReadOnlyModelViewSet):
+class PlatformApiCallViewSet(RequestTimingMixin, ReplicaReadMixin, StreamingExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = PlatformApiCall.objects.all()
     serializer_class = PlatformApiCallSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]  # Only admins can view API calls
+    pagination_class = PlatformApiCallCursorPagination
+    export_fields = [
+        'id', 'user_id', 'requested_url', 'method', 'status_code', 'duration_ms',
+        'requested_data', 'response_data', 'payload_encoding', 'timestamp',
+    ]
+    export_filename = 'api_calls'
+
+    def export_rows(self, queryset):
+        # Oldest first, along the (timestamp, id) index
+        return super().export_rows(queryset.order_by('timestamp', 'id'))
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -62,5 +133,62 @@ class PlatformApiCallViewSet(viewsets.ReadOnlyModelViewSet):
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        # Unpaginated this is the whole table, so stream it a chunk at a time;
+        # the rows are read after the view returns, from the database chosen now
+        queryset = queryset.using(queryset.db).select_related('user')
+        return exports.stream_list(queryset, lambda calls: self.get_serializer(calls, many=True).data)
+
+class SalesAnalyticsViewSet(RequestTimingMixin, ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Sales over a range of days, answered from the daily rollups alone; days
+    after `complete_through` are not rolled up yet and read as empty.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def list(self, request):
+        return Response({'complete_through': rollups.complete_through()})
+
+    @action(detail=False, methods=['get'], url_path='seller-revenue')
+    def seller_revenue(self, request):
+        params = self.get_params(request)
+        rows = rollups.seller_revenue(params['start'], params['end'], params.get('seller'))
+        return self.respond(params, SellerRevenueSerializer(rows, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='top-products')
+    def top_products(self, request):
+        params = self.get_params(request)
+        rows = rollups.top_products(params['start'], params['end'], params['limit'], params.get('seller'))
+        return self.respond(params, TopProductSerializer(rows, many=True).data)
+
+    def get_params(self, request):
+        serializer = SalesRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def respond(self, params, results):
+        return Response({
+            'start': params['start'], 'end': params['end'],
+            'complete_through': rollups.complete_through(), 'results': results,
+        })
+
+class RequestMetricsView(APIView):
+    # Per-endpoint latency histogram of this process; DELETE resets it
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response(instrumentation.histogram.snapshot())
+
+    def delete(self, request):
+        instrumentation.histogram.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class ConnectionMetricsView(APIView):
+    # Database connection churn and pool stats of this process; DELETE resets the counters
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response(pooling.stats())
+
+    def delete(self, request):
+        pooling.counters.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
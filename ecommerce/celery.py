@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
@@ -14,4 +15,11 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def flush_api_call_log(**kwargs):
+    # Drain any buffered audit log records before the worker exits
+    from api.audit import shutdown
+    shutdown()
@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import sys
+import warnings
+from importlib.util import find_spec
 from celery.schedules import crontab
 from pathlib import Path
 from dotenv import load_dotenv
@@ -18,6 +21,9 @@ from dotenv import load_dotenv
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(os.path.join(BASE_DIR, '.env'))
 
+# Running under `manage.py test`, where some defaults below change
+TESTING = sys.argv[1:2] == ['test']
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -56,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'api.instrumentation.RequestInstrumentationMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -95,6 +102,91 @@ DATABASES = {
     }
 }
 
+# Read replicas of `default`: comma-separated PostgreSQL hosts, each added as
+# a `replica_<n>` alias. GET requests to the order, product and API call
+# endpoints read from one of them (see api.replicas)
+DATABASE_REPLICAS = []
+for n, host in enumerate(host.strip() for host in os.getenv('DATABASE_REPLICA_HOSTS', '').split(',') if host.strip()):
+    DATABASES[f'replica_{n}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{n}')
+
+# Run on a SQLite file instead, e.g. for the query budget tests and
+# `manage.py bench_api` in CI. A second file stands in for a replica; reads
+# are only routed to it when SQLITE_REPLICA_DATABASE is set.
+if os.getenv('SQLITE_DATABASE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_DATABASE'),
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_REPLICA_DATABASE', f"{os.getenv('SQLITE_DATABASE')}.replica"),
+        },
+    }
+    DATABASE_REPLICAS = ['replica'] if os.getenv('SQLITE_REPLICA_DATABASE') else []
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write, to ride out
+# replication lag. Pins live in the cache, so share it (CACHE_REDIS_URL)
+# between web processes.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
+# Connection handling, per process, so web and Celery workers can differ:
+# 'none' opens a connection per request or task, 'persistent' keeps each
+# thread's connection for DATABASE_CONN_MAX_AGE seconds and checks it before
+# reuse, 'pool' shares DATABASE_POOL_MIN_SIZE..DATABASE_POOL_MAX_SIZE
+# PostgreSQL connections per process, waiting at most DATABASE_POOL_TIMEOUT
+# seconds for a free one. 'pool' needs psycopg 3 with psycopg_pool, which
+# requirements.txt installs; without them it warns and falls back to 'none'.
+# ASGI runs each request's queries in a new thread, where 'persistent'
+# connections are never reused but stay open, so the default is 'pool';
+# choose 'persistent' only for WSGI processes and Celery workers.
+DATABASE_POOL_AVAILABLE = bool(find_spec('psycopg') and find_spec('psycopg_pool'))
+DATABASE_POOL_MODE = os.getenv('DATABASE_POOL_MODE', 'pool' if DATABASE_POOL_AVAILABLE else 'none')
+DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', '60'))
+DATABASE_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', '2'))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', '10'))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '10'))
+
+if DATABASE_POOL_MODE == 'pool' and not DATABASE_POOL_AVAILABLE:
+    warnings.warn("DATABASE_POOL_MODE 'pool' needs psycopg 3 and psycopg_pool; using 'none'")
+    DATABASE_POOL_MODE = 'none'
+
+for database in DATABASES.values():
+    pooled = DATABASE_POOL_MODE == 'pool' and database['ENGINE'] == 'django.db.backends.postgresql'
+    database['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE if DATABASE_POOL_MODE != 'none' and not pooled else 0
+    database['CONN_HEALTH_CHECKS'] = DATABASE_POOL_MODE != 'none'
+    if pooled:
+        database['OPTIONS'] = {
+            **database.get('OPTIONS', {}),
+            'pool': {'min_size': DATABASE_POOL_MIN_SIZE, 'max_size': DATABASE_POOL_MAX_SIZE, 'timeout': DATABASE_POOL_TIMEOUT},
+        }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Set CACHE_REDIS_URL to share the cache (and its invalidations) between web and
+# Celery processes; the local-memory default is per process.
+
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ecommerce',
+        }
+    }
+
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -139,7 +231,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -147,17 +239,126 @@ REST_FRAMEWORK = {
     ],
 }
 
+# CachedTokenAuthentication: seconds a token stays in the shared cache, and
+# size and seconds of each process's LRU in front of it (the longest another
+# process may keep trusting a deleted token or a deactivated user)
+TOKEN_AUTH_CACHE_TTL = int(os.getenv('TOKEN_AUTH_CACHE_TTL', 300))
+TOKEN_AUTH_LRU_SIZE = int(os.getenv('TOKEN_AUTH_LRU_SIZE', 10000))
+TOKEN_AUTH_LRU_TTL = int(os.getenv('TOKEN_AUTH_LRU_TTL', 30))
+
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 CELERY_TIMEZONE = os.getenv('CELERY_TIMEZONE', 'UTC')
+# Catalogue read by the nightly import; a CSV, NDJSON or Parquet copy made with
+# `manage.py convert_products` imports much faster than the Excel original.
+PRODUCT_IMPORT_FILE = os.getenv('PRODUCT_IMPORT_FILE', 'Product_data.xlsx')
+
 CELERY_BEAT_SCHEDULE = {
     'daily_product_import': {
-        'task': 'api.tasks.bulk_import_products',
+        'task': 'api.tasks.import_products',
         'schedule': crontab(hour=14, minute=30),
-        'args': ('Product_data.xlsx', )
+        'args': (PRODUCT_IMPORT_FILE, ),
+        'kwargs': {'incremental': True},
+    },
+    'api_call_retention': {
+        'task': 'api.tasks.apply_api_call_retention',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Hourly, so a missed run is caught up within the hour; runs with no
+    # newly completed day do nothing
+    'sales_rollups': {
+        'task': 'api.tasks.roll_up_sales',
+        'schedule': crontab(minute=20),
     },
 }
 
+# Parallel product import (api.tasks.import_products_parallel): rows per chunk
+# task, and how many chunk tasks may be in flight at once (0 = no limit).
+PRODUCT_IMPORT_CHUNK_SIZE = int(os.getenv('PRODUCT_IMPORT_CHUNK_SIZE', 5000))
+PRODUCT_IMPORT_CONCURRENCY = int(os.getenv('PRODUCT_IMPORT_CONCURRENCY', 0))
+
+# Product name search: 'database' filters with icontains, backed by a pg_trgm
+# index on PostgreSQL; 'memory' uses an in-process trigram index; 'auto' picks
+# 'database' on PostgreSQL and 'memory' elsewhere.
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND', 'auto')
+
+# Order summaries: 'sync' updates them in the request from Order signals,
+# 'celery' refreshes them in the refresh_order_summaries task after commit.
+ORDER_SUMMARY_MODE = os.getenv('ORDER_SUMMARY_MODE', 'sync')
+ORDER_SUMMARY_TOP_N = int(os.getenv('ORDER_SUMMARY_TOP_N', 100))
+
+# Daily sales rollups (api.rollups): days rolled up per transaction, minutes
+# after midnight (TIME_ZONE) before a day counts as complete, and the longest
+# range in days the analytics endpoints answer.
+SALES_ROLLUP_BATCH_DAYS = int(os.getenv('SALES_ROLLUP_BATCH_DAYS', 31))
+SALES_ROLLUP_DELAY_MINUTES = int(os.getenv('SALES_ROLLUP_DELAY_MINUTES', 10))
+SALES_ANALYTICS_MAX_DAYS = int(os.getenv('SALES_ANALYTICS_MAX_DAYS', 366))
+
+# Order list facets (?facets=true): values listed per seller, customer and
+# product facet, amount bucket edges, and seconds the counts are cached.
+ORDER_FACET_LIMIT = int(os.getenv('ORDER_FACET_LIMIT', 20))
+ORDER_FACET_AMOUNT_BUCKETS = [edge.strip() for edge in os.getenv('ORDER_FACET_AMOUNT_BUCKETS', '10,50,100,500,1000').split(',') if edge.strip()]
+ORDER_FACET_CACHE_TIMEOUT = int(os.getenv('ORDER_FACET_CACHE_TIMEOUT', 30))
+
+# Largest batch accepted by POST /api/orders/bulk/
+ORDER_BULK_MAX_ITEMS = int(os.getenv('ORDER_BULK_MAX_ITEMS', 5000))
+
+# Rows fetched per round trip by the streaming CSV/NDJSON exports
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Order amounts: 'compute' derives them from product prices, 'verify' rejects
+# a client amount that differs, 'client' trusts the client as before
+ORDER_AMOUNT_MODE = os.getenv('ORDER_AMOUNT_MODE', 'compute')
+
+# Seconds a process keeps a product price before re-reading it
+PRODUCT_PRICE_CACHE_TTL = int(os.getenv('PRODUCT_PRICE_CACHE_TTL', 60))
+
+# API call audit log: 'sync' writes one row per request, 'buffered' batches rows
+# in-process and 'celery' hands each batch to the write_api_calls task. Tests
+# default to 'sync', so rows are written inside each test's transaction
+# rather than by the buffer's thread after it has rolled back.
+API_CALL_LOG_MODE = os.getenv('API_CALL_LOG_MODE', 'sync' if TESTING else 'buffered')
+API_CALL_LOG_BATCH_SIZE = int(os.getenv('API_CALL_LOG_BATCH_SIZE', 200))
+API_CALL_LOG_FLUSH_INTERVAL = float(os.getenv('API_CALL_LOG_FLUSH_INTERVAL', 2.0))
+API_CALL_LOG_MAX_QUEUE = int(os.getenv('API_CALL_LOG_MAX_QUEUE', 10000))
+# Approximate bytes of bodies the queue may hold (0 = no limit); bodies are
+# cut to API_CALL_LOG_MAX_PAYLOAD before they are queued
+API_CALL_LOG_MAX_QUEUE_BYTES = int(os.getenv('API_CALL_LOG_MAX_QUEUE_BYTES', 64 * 1024 * 1024))
+
+# Default API call logging policy; viewsets override it with
+# `api_call_log_policy` (see api.audit.get_policy). Fraction of calls logged,
+# longest stored body in characters (0 = no limit), zlib-compress stored
+# bodies, and log only URL, user, method, status and duration.
+API_CALL_LOG_SAMPLE_RATE = float(os.getenv('API_CALL_LOG_SAMPLE_RATE', 1.0))
+API_CALL_LOG_MAX_PAYLOAD = int(os.getenv('API_CALL_LOG_MAX_PAYLOAD', 65536))
+API_CALL_LOG_COMPRESS = os.getenv('API_CALL_LOG_COMPRESS', 'False') == 'True'
+API_CALL_LOG_METADATA_ONLY = os.getenv('API_CALL_LOG_METADATA_ONLY', 'False') == 'True'
+
+# API call retention, by age in days (0 = keep forever): request and response
+# bodies are blanked after PAYLOAD days, rows are archived to gzip NDJSON in
+# ARCHIVE_DIR and deleted after RETENTION days, and archive files are removed
+# after ARCHIVE_RETENTION days.
+API_CALL_PAYLOAD_RETENTION_DAYS = int(os.getenv('API_CALL_PAYLOAD_RETENTION_DAYS', 30))
+API_CALL_RETENTION_DAYS = int(os.getenv('API_CALL_RETENTION_DAYS', 90))
+API_CALL_ARCHIVE_RETENTION_DAYS = int(os.getenv('API_CALL_ARCHIVE_RETENTION_DAYS', 0))
+API_CALL_ARCHIVE_DIR = os.getenv('API_CALL_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'api_calls'))
+API_CALL_RETENTION_BATCH_SIZE = int(os.getenv('API_CALL_RETENTION_BATCH_SIZE', 5000))
+# Monthly partitions created ahead of time once `manage.py partition_api_calls`
+# has converted the table (PostgreSQL only)
+API_CALL_PARTITION_MONTHS_AHEAD = int(os.getenv('API_CALL_PARTITION_MONTHS_AHEAD', 3))
+
+# Per-request timing and SQL instrumentation (api.instrumentation): requests
+# slower than REQUEST_SLOW_MS are logged with up to REQUEST_SLOW_MAX_QUERIES
+# of their SQL statements; REQUEST_SERVER_TIMING adds a Server-Timing header.
+REQUEST_INSTRUMENTATION = os.getenv('REQUEST_INSTRUMENTATION', 'True') == 'True'
+REQUEST_SLOW_MS = float(os.getenv('REQUEST_SLOW_MS', 500))
+REQUEST_SLOW_MAX_QUERIES = int(os.getenv('REQUEST_SLOW_MAX_QUERIES', 100))
+REQUEST_SERVER_TIMING = os.getenv('REQUEST_SERVER_TIMING', 'True') == 'True'
+# The per-request lines (api.requests) and slow requests (api.slow_requests)
+# go to stdout rather than api.log; WARNING keeps only the slow ones, which
+# is the default under `manage.py test`.
+REQUEST_LOG_LEVEL = os.getenv('REQUEST_LOG_LEVEL', 'WARNING' if TESTING else 'INFO')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -167,6 +368,10 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': BASE_DIR / 'api.log',
         },
+        'requests': {
+            'class': 'logging.StreamHandler',
+            'stream': 'ext://sys.stdout',
+        },
     },
     'loggers': {
         'api': {
@@ -174,5 +379,15 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'api.requests': {
+            'handlers': ['requests'],
+            'level': REQUEST_LOG_LEVEL,
+            'propagate': False,
+        },
+        'api.slow_requests': {
+            'handlers': ['requests'],
+            'level': REQUEST_LOG_LEVEL,
+            'propagate': False,
+        },
     },
 }